@@ -27,6 +27,7 @@ class IncrementalIndexer:
         self.repos_dir = (script_dir / repos_dir).resolve()
         self.metadata_file = Path(db_path) / "repo_metadata.json"
         self.repo_metadata = self.load_metadata()
+        self.write_batch_size = 1000  # Chunks per ChromaDB add() call
 
     def load_metadata(self) -> Dict:
         """Load repository metadata (last commit hashes, file hashes)"""
@@ -151,6 +152,21 @@ class IncrementalIndexer:
             self.vectorizer.collection.delete(ids=chunk_ids_to_delete)
             print(f"Removed {len(chunk_ids_to_delete)} chunks for deleted files")
 
+    def add_chunks(self, pending_chunks: List[Tuple[str, List[float], str, Dict]]):
+        """
+        Write (id, embedding, document, metadata) tuples to ChromaDB in large batches
+        Upserts, since a re-chunked file can reuse the ids of its still-stored old chunks
+        """
+        for start in range(0, len(pending_chunks), self.write_batch_size):
+            batch = pending_chunks[start:start + self.write_batch_size]
+            ids, embeddings, documents, metadatas = (list(column) for column in zip(*batch))
+            self.vectorizer.collection.upsert(
+                ids=ids,
+                embeddings=embeddings,
+                documents=documents,
+                metadatas=metadatas
+            )
+
     def update_repository(self, repo_name: str, pull_latest: bool = True) -> int:
         """
         Update a specific repository with only changed files
@@ -182,6 +198,8 @@ class IncrementalIndexer:
         # Process changed files
         chunks_processed = 0
         updated_file_hashes = self.repo_metadata.get(repo_name, {}).get('file_hashes', {})
+        pending_chunks = []  # Written once per repo instead of one transaction per chunk
+        pending_files = []  # (relative_path, old_chunk_ids, new_chunk_ids, file_hash), settled once written
         
         for file_path in changed_files:
             try:
@@ -194,7 +212,7 @@ class IncrementalIndexer:
                 language = self.vectorizer.code_extensions[file_path.suffix]
                 relative_path = str(file_path.relative_to(repo_path))
                 
-                # Remove old chunks for this file first
+                # Find old chunks for this file (removed once the new ones are written)
                 all_metadata = self.vectorizer.collection.get()
                 old_chunk_ids = []
                 
@@ -203,34 +221,37 @@ class IncrementalIndexer:
                         metadata.get('file_path') == relative_path):
                         old_chunk_ids.append(all_metadata['ids'][i])
                 
-                if old_chunk_ids:
-                    self.vectorizer.collection.delete(ids=old_chunk_ids)
-                
                 # Create new chunks
                 chunks = self.vectorizer.chunk_code(content, relative_path, repo_name, language)
+                file_chunks = []
                 
                 for chunk in chunks:
                     embedding = self.vectorizer.get_embedding(chunk.content)
                     if embedding is None:
                         continue
                         
-                    self.vectorizer.collection.add(
-                        ids=[chunk.chunk_id],
-                        embeddings=[embedding],
-                        documents=[chunk.content],
-                        metadatas=[{
+                    file_chunks.append((
+                        chunk.chunk_id,
+                        embedding,
+                        chunk.content,
+                        {
                             'file_path': chunk.file_path,
                             'repo_name': chunk.repo_name,
                             'start_line': chunk.start_line,
                             'end_line': chunk.end_line,
                             'language': chunk.language,
                             'indexed_at': datetime.now().isoformat()
-                        }]
-                    )
+                        }
+                    ))
                     chunks_processed += 1
                 
-                # Update file hash
-                updated_file_hashes[relative_path] = self.get_file_hash(file_path)
+                pending_chunks.extend(file_chunks)
+                pending_files.append((
+                    relative_path,
+                    old_chunk_ids,
+                    {chunk_id for chunk_id, _, _, _ in file_chunks},
+                    self.get_file_hash(file_path)
+                ))
                 
                 if chunks_processed % 10 == 0 and chunks_processed > 0:
                     print(f"Processed {chunks_processed} chunks...")
@@ -239,15 +260,42 @@ class IncrementalIndexer:
                 print(f"Error processing {file_path}: {e}")
                 continue
         
+        write_succeeded = True
+        if pending_chunks:
+            print(f"Writing {len(pending_chunks)} chunks to database...")
+            try:
+                self.add_chunks(pending_chunks)
+            except Exception as e:
+                print(f"Error writing chunks for {repo_name}: {e}")
+                write_succeeded = False
+        
+        if write_succeeded:
+            # New chunks are stored: drop the old ones they replace and mark the files indexed
+            stale_chunk_ids = [
+                chunk_id
+                for _, old_chunk_ids, new_chunk_ids, _ in pending_files
+                for chunk_id in old_chunk_ids
+                if chunk_id not in new_chunk_ids
+            ]
+            if stale_chunk_ids:
+                self.vectorizer.collection.delete(ids=stale_chunk_ids)
+            
+            for relative_path, _, _, file_hash in pending_files:
+                updated_file_hashes[relative_path] = file_hash
+        else:
+            chunks_processed = 0
+        
         # Update metadata
         if repo_name not in self.repo_metadata:
             self.repo_metadata[repo_name] = {}
         
         self.repo_metadata[repo_name].update({
-            'last_commit': current_commit,
             'file_hashes': updated_file_hashes,
             'last_updated': datetime.now().isoformat()
         })
+        if write_succeeded:
+            # Otherwise keep the old commit so the next run re-checks (and retries) these files
+            self.repo_metadata[repo_name]['last_commit'] = current_commit
         
         # Remove hashes for deleted files
         for deleted_file in deleted_files:
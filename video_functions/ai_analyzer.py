@@ -4,23 +4,117 @@ AI Analysis Functions
 Analyze screenshots with OpenAI Vision API to enhance page descriptions
 """
 
+import io
 import json
+import orjson
 import base64
+import asyncio
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
-import cv2
+from openai import AsyncOpenAI
 import numpy as np
-from skimage.metrics import structural_similarity as ssim
+from PIL import Image
 
-load_dotenv()
+from .image_hashing import (
+    HASH_BITS, BKTree, compute_file_digest, compute_phash, compute_phashes, load_thumbnail, structural_similarity
+)
+from .openai_client import create_async_openai_client, create_completion_with_retry_async
+from .rate_limiter import RateLimiter, estimate_request_tokens
+
+# Structured Outputs schema for one screenshot analysis; the API guarantees
+# replies parse and carry every key, so no fence stripping or fallbacks
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "comprehensive_page_description": {"type": "string"},
+        "ui_elements_detected": {"type": "array", "items": {"type": "string"}},
+        "possible_user_actions": {"type": "array", "items": {"type": "string"}},
+        "elements_mentioned_by_user": {"type": "array", "items": {"type": "string"}},
+        "page_features": {"type": "array", "items": {"type": "string"}},
+        "interaction_context": {"type": "string"}
+    },
+    "required": [
+        "comprehensive_page_description",
+        "ui_elements_detected",
+        "possible_user_actions",
+        "elements_mentioned_by_user",
+        "page_features",
+        "interaction_context"
+    ],
+    "additionalProperties": False
+}
+
+ANALYSIS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "screenshot_analysis", "strict": True, "schema": ANALYSIS_SCHEMA}
+}
+
+BATCH_ANALYSIS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "screenshot_analyses",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"analyses": {"type": "array", "items": ANALYSIS_SCHEMA}},
+            "required": ["analyses"],
+            "additionalProperties": False
+        }
+    }
+}
+
+@lru_cache(maxsize=128)
+def _encode_image_cached(
+    image_path: str,
+    mtime_ns: int,
+    max_image_size: Tuple[int, int],
+    jpeg_quality: int,
+    crop_region: Optional[Tuple[float, float]]
+) -> str:
+    """
+    Encode an image once per (path, mtime, size, quality, crop)
+    
+    Module-level so the cache holds only encoded images, not analyzer instances.
+    
+    Args:
+        image_path: Path to image file (str so results can be cached)
+        mtime_ns: Modification time, so a rewritten file is encoded again
+        max_image_size: Bounding box to downscale into
+        jpeg_quality: JPEG quality to re-encode at
+        crop_region: Top-left (width, height) fractions to keep, or None for the whole image
+    
+    Returns:
+        Base64 JPEG
+    """
+    with Image.open(image_path) as img:
+        img = img.convert('RGB')
+        if crop_region is not None:
+            # Only the browser address bar matters for URL extraction; cropping
+            # also keeps its text legible after low-detail downsampling
+            width, height = img.size
+            width_fraction, height_fraction = crop_region
+            img = img.crop((0, 0, int(width * width_fraction), int(height * height_fraction)))
+        img.thumbnail(max_image_size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=jpeg_quality, optimize=True)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
 
 class AIAnalyzer:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    def __init__(self, max_concurrent_requests: int = 8, max_requests_per_minute: int = 500, max_tokens_per_minute: int = 30000):
+        self.max_concurrent_requests = max_concurrent_requests  # Tune to the account's rate limit tier
+        self.rate_limiter = RateLimiter(max_requests_per_minute, max_tokens_per_minute)
+        self.screenshots_per_request = 4  # Unique screenshots batched into one Vision call
         self.similarity_threshold = 0.90  # 90% similarity threshold
+        self.phash_threshold = 16  # Hamming distance (of 256 bits) treated as a duplicate outright
+        self.phash_borderline = 40  # Distances up to this are confirmed with SSIM
+        self.max_image_size = (768, 768)  # Plenty for UI elements at low detail
+        self.jpeg_quality = 80
+        self.image_detail = "low"  # 85 image tokens instead of ~765+ at high detail
+        self.address_bar_region = (0.5, 0.15)  # Top-left width/height fractions sent for URL extraction
+        self.vision_model = "gpt-4o"
+        self.analysis_prompt_version = 1  # Bump when the analysis prompts change to invalidate cached analyses
+        self.analysis_cache = {}  # "model:prompt_version:sha256" -> analysis, persisted across runs
     
     def analyze_pages_with_ai(self, pages: List[Dict], base_output_dir: Path, output_dir: Path, cleanup_duplicates: bool = False) -> List[Dict]:
         """
@@ -37,30 +131,53 @@ class AIAnalyzer:
         """
         print(f"Analyzing {len(pages)} pages with OpenAI Vision...")
         
-        enhanced_pages = []
+        # Analyses from earlier runs, keyed by screenshot content
+        analysis_cache_path = output_dir / "vision_analysis_cache.json"
+        self.analysis_cache = self._load_analysis_cache(analysis_cache_path)
+        
+        # Hash every screenshot in parallel before the sequential dedup passes
+        compute_phashes([
+            str(base_output_dir / sentence['screenshot'])
+            for page in pages for sentence in page['sentences'] if sentence.get('screenshot')
+        ])
+        
+        # Find unique screenshots for every page before making any API calls. The index
+        # spans all pages, so a UI state seen on an earlier page is not analyzed again
+        page_unique_screenshots = []
+        processed_images = BKTree()
+        seen_digests = set()
         
         for page_idx, page in enumerate(pages):
             print(f"\nProcessing page {page_idx + 1}/{len(pages)}: {page['page_name']}")
             
-            # Extract URL from first screenshot if available
-            if page['sentences'] and page['sentences'][0].get('screenshot'):
-                page['relative_url'] = self._extract_url_from_screenshot(
-                    page['sentences'][0], base_output_dir
-                )
-            
-            # Find unique screenshots for this page
-            unique_screenshots = self._find_unique_screenshots(page['sentences'], base_output_dir)
+            unique_screenshots = self._find_unique_screenshots(
+                page['sentences'], base_output_dir, processed_images, seen_digests
+            )
             print(f"  Will analyze {len(unique_screenshots)} unique screenshots out of {len(page['sentences'])} total")
-            
-            # Create analysis cache for duplicates
-            analysis_cache = {}
-            
-            # Analyze unique screenshots
-            for unique_idx, unique_sentence in unique_screenshots:
-                print(f"  Analyzing unique screenshot {unique_idx}")
-                analysis = self._analyze_screenshot_with_context(unique_sentence, page, base_output_dir)
-                analysis_cache[unique_sentence.get('screenshot')] = analysis
-            
+            page_unique_screenshots.append(unique_screenshots)
+        
+        # Run the Vision calls for all pages concurrently
+        print(f"\nRunning Vision analysis (up to {self.max_concurrent_requests} concurrent requests)...")
+        page_analysis_caches = asyncio.run(
+            self._analyze_all_pages(pages, page_unique_screenshots, base_output_dir)
+        )
+        self._save_analysis_cache(analysis_cache_path)
+        
+        # Index analyses across all pages so duplicates on any page can reuse them
+        analysis_cache = {}
+        analysis_index = BKTree()
+        for unique_screenshots, page_cache in zip(page_unique_screenshots, page_analysis_caches):
+            analysis_cache.update(page_cache)
+            for _, unique_sentence in unique_screenshots:
+                self._index_screenshot(
+                    analysis_index,
+                    base_output_dir / unique_sentence['screenshot'],
+                    page_cache[unique_sentence['screenshot']]
+                )
+        
+        enhanced_pages = []
+        
+        for page in pages:
             # Build enhanced sentences, reusing analysis for similar screenshots
             enhanced_sentences = []
             
@@ -77,16 +194,7 @@ class AIAnalyzer:
                     if screenshot_path:
                         current_img_path = base_output_dir / screenshot_path
                         if current_img_path.exists():
-                            best_similarity = 0.0
-                            best_analysis = None
-                            
-                            for cached_screenshot, cached_analysis in analysis_cache.items():
-                                cached_img_path = base_output_dir / cached_screenshot
-                                if cached_img_path.exists():
-                                    similarity = self._calculate_image_similarity(current_img_path, cached_img_path)
-                                    if similarity >= self.similarity_threshold and similarity > best_similarity:
-                                        best_similarity = similarity
-                                        best_analysis = cached_analysis
+                            best_analysis, best_similarity = self._find_similar_screenshot(analysis_index, current_img_path)
                             
                             if best_analysis:
                                 analysis = best_analysis
@@ -126,8 +234,8 @@ class AIAnalyzer:
         
         # Save enhanced pages
         output_path = output_dir / "ai_enhanced_pages.json"
-        with open(output_path, 'w') as f:
-            json.dump(enhanced_pages, f, indent=2)
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(enhanced_pages, option=orjson.OPT_INDENT_2))
         
         print(f"\n✅ AI analysis complete!")
         print(f"Enhanced pages saved to: {output_path}")
@@ -136,7 +244,81 @@ class AIAnalyzer:
         
         return enhanced_pages
     
-    def _extract_url_from_screenshot(self, sentence: Dict, base_output_dir: Path) -> str:
+    async def _analyze_all_pages(self, pages: List[Dict], page_unique_screenshots: List[List[Tuple[int, Dict]]], base_output_dir: Path) -> List[Dict[str, Dict]]:
+        """Analyze every page concurrently, sharing one client and one request cap"""
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        
+        async with create_async_openai_client() as client:
+            return await asyncio.gather(*(
+                self._analyze_page_screenshots(client, semaphore, page, unique_screenshots, base_output_dir)
+                for page, unique_screenshots in zip(pages, page_unique_screenshots)
+            ))
+    
+    async def _analyze_page_screenshots(
+        self,
+        client: AsyncOpenAI,
+        semaphore: asyncio.Semaphore,
+        page: Dict,
+        unique_screenshots: List[Tuple[int, Dict]],
+        base_output_dir: Path
+    ) -> Dict[str, Dict]:
+        """Extract the page URL, then analyze its unique screenshots concurrently"""
+        # URL goes into the analysis prompt, so it is extracted first
+        if page['sentences'] and page['sentences'][0].get('screenshot'):
+            async with semaphore:
+                page['relative_url'] = await self._extract_url_from_screenshot(
+                    client, page['sentences'][0], base_output_dir
+                )
+        
+        async def analyze(unique_idx: int, unique_sentence: Dict) -> Dict:
+            async with semaphore:
+                print(f"  Analyzing unique screenshot {unique_idx} ({page['page_name']})")
+                return await self._analyze_screenshot_with_context(client, unique_sentence, page, base_output_dir)
+        
+        async def analyze_batch(batch: List[Tuple[int, Dict]]) -> List[Dict]:
+            if len(batch) == 1:
+                return [await analyze(*batch[0])]
+            
+            async with semaphore:
+                print(f"  Analyzing unique screenshots {[idx for idx, _ in batch]} ({page['page_name']})")
+                analyses = await self._analyze_screenshot_batch(
+                    client, [sentence for _, sentence in batch], page, base_output_dir
+                )
+            
+            if analyses is None:
+                # Batch response unusable - analyze each screenshot on its own
+                analyses = await asyncio.gather(*(analyze(idx, sentence) for idx, sentence in batch))
+            return analyses
+        
+        # Reuse analyses of screenshots unchanged since an earlier run
+        page_analyses = {}
+        uncached_screenshots = []
+        for unique_idx, unique_sentence in unique_screenshots:
+            cache_key = self._analysis_cache_key(base_output_dir / unique_sentence['screenshot'])
+            if cache_key in self.analysis_cache:
+                page_analyses[unique_sentence['screenshot']] = self.analysis_cache[cache_key]
+            else:
+                uncached_screenshots.append((unique_idx, unique_sentence))
+        
+        if page_analyses:
+            print(f"  Reusing {len(page_analyses)} cached analyses ({page['page_name']})")
+        
+        batch_size = self.screenshots_per_request
+        batches = [uncached_screenshots[i:i + batch_size] for i in range(0, len(uncached_screenshots), batch_size)]
+        batch_results = await asyncio.gather(*(analyze_batch(batch) for batch in batches))
+        
+        empty_analysis = self._create_empty_analysis()
+        for batch, analyses in zip(batches, batch_results):
+            for (_, unique_sentence), analysis in zip(batch, analyses):
+                page_analyses[unique_sentence['screenshot']] = analysis
+                
+                cache_key = self._analysis_cache_key(base_output_dir / unique_sentence['screenshot'])
+                if cache_key and analysis != empty_analysis:
+                    self.analysis_cache[cache_key] = analysis
+        
+        return page_analyses
+    
+    async def _extract_url_from_screenshot(self, client: AsyncOpenAI, sentence: Dict, base_output_dir: Path) -> str:
         """Extract relative URL from screenshot using OpenAI Vision"""
         if not sentence.get('screenshot'):
             return "unknown"
@@ -146,24 +328,30 @@ class AIAnalyzer:
             return "unknown"
         
         try:
-            base64_image = self._encode_image(screenshot_path)
+            base64_image = await asyncio.to_thread(self._encode_image, screenshot_path, True)
+            
+            prompt = """Look at this screenshot and extract the URL from the browser address bar.
+                                Return ONLY the relative path after the domain (e.g., '/calendar', '/activities', '/workouts/123').
+                                If no URL is clearly visible in the address bar, return 'unknown'."""
             
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
+            response = await create_completion_with_retry_async(
+                client,
+                rate_limiter=self.rate_limiter,
+                estimated_tokens=estimate_request_tokens(prompt, max_tokens=50, detail='low'),
+                model=self.vision_model,
                 messages=[
                     {
                         "role": "user",
                         "content": [
                             {
                                 "type": "text",
-                                "text": """Look at this screenshot and extract the URL from the browser address bar.
-                                Return ONLY the relative path after the domain (e.g., '/calendar', '/activities', '/workouts/123').
-                                If no URL is clearly visible in the address bar, return 'unknown'."""
+                                "text": prompt
                             },
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
+                                    "url": f"data:image/jpeg;base64,{base64_image}",
+                                    "detail": "low"
                                 }
                             }
                         ]
@@ -179,7 +367,7 @@ class AIAnalyzer:
             print(f"Error extracting URL from screenshot: {e}")
             return "unknown"
     
-    def _analyze_screenshot_with_context(self, sentence: Dict, page: Dict, base_output_dir: Path) -> Dict:
+    async def _analyze_screenshot_with_context(self, client: AsyncOpenAI, sentence: Dict, page: Dict, base_output_dir: Path) -> Dict:
         """Analyze screenshot with full context using OpenAI Vision"""
         if not sentence.get('screenshot'):
             return self._create_empty_analysis()
@@ -189,7 +377,7 @@ class AIAnalyzer:
             return self._create_empty_analysis()
         
         try:
-            base64_image = self._encode_image(screenshot_path)
+            base64_image = await asyncio.to_thread(self._encode_image, screenshot_path)
             
             prompt = f"""
             Page Context: {page['page_name']} ({page.get('relative_url', 'unknown')})
@@ -214,8 +402,11 @@ class AIAnalyzer:
             Focus on actionable UI elements like buttons, menus, forms, navigation items.
             """
             
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
+            response = await create_completion_with_retry_async(
+                client,
+                rate_limiter=self.rate_limiter,
+                estimated_tokens=estimate_request_tokens(prompt, max_tokens=500, detail=self.image_detail),
+                model=self.vision_model,
                 messages=[
                     {
                         "role": "user",
@@ -227,46 +418,135 @@ class AIAnalyzer:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
+                                    "url": f"data:image/jpeg;base64,{base64_image}",
+                                    "detail": self.image_detail
                                 }
                             }
                         ]
                     }
                 ],
-                max_tokens=500
+                max_tokens=500,
+                response_format=ANALYSIS_RESPONSE_FORMAT
             )
             
-            # Parse JSON response
-            content = response.choices[0].message.content
-            try:
-                # Remove markdown code blocks if present
-                if content.startswith('```json'):
-                    content = content.replace('```json', '').replace('```', '').strip()
-                elif content.startswith('```'):
-                    content = content.replace('```', '').strip()
-                
-                analysis = json.loads(content)
-            except json.JSONDecodeError:
-                # Fallback if JSON parsing fails
-                analysis = {
-                    "comprehensive_page_description": content,
-                    "ui_elements_detected": [],
-                    "possible_user_actions": [],
-                    "elements_mentioned_by_user": [],
-                    "page_features": [],
-                    "interaction_context": ""
-                }
-            
-            return analysis
+            # Truncated (max_tokens) or refused replies raise here and fall back to empty
+            return json.loads(response.choices[0].message.content)
             
         except Exception as e:
             print(f"Error analyzing screenshot: {e}")
             return self._create_empty_analysis()
     
-    def _encode_image(self, image_path: Path) -> str:
-        """Encode image to base64 for OpenAI Vision API"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+    async def _analyze_screenshot_batch(self, client: AsyncOpenAI, sentences: List[Dict], page: Dict, base_output_dir: Path) -> Optional[List[Dict]]:
+        """
+        Analyze several screenshots of one page in a single Vision request
+        
+        Returns:
+            One analysis per sentence in order, or None if the response could not be used
+        """
+        try:
+            base64_images = await asyncio.gather(*(
+                asyncio.to_thread(self._encode_image, base_output_dir / sentence['screenshot'])
+                for sentence in sentences
+            ))
+            
+            image_contexts = "\n".join(
+                f'            {number}. User Description: "{sentence["sentence"]}" (Timestamp: {sentence.get("timestamp", "unknown")})'
+                for number, sentence in enumerate(sentences, 1)
+            )
+            
+            prompt = f"""
+            Page Context: {page['page_name']} ({page.get('relative_url', 'unknown')})
+            
+            The following {len(sentences)} screenshots are numbered 1..{len(sentences)} in the order attached.
+            While each one was on screen, the user described:
+{image_contexts}
+            
+            Analyze each screenshot with its user description as context.
+            
+            Please provide a JSON response with an "analyses" array holding one object per screenshot, in the same order:
+            {{
+                "analyses": [
+                    {{
+                        "comprehensive_page_description": "Detailed description expanding on what the user said",
+                        "ui_elements_detected": ["element1", "element2", "element3"],
+                        "possible_user_actions": ["action1", "action2", "action3"],
+                        "elements_mentioned_by_user": ["specific elements the user referenced"],
+                        "page_features": ["key features visible on this page"],
+                        "interaction_context": "How this relates to what the user was demonstrating"
+                    }}
+                ]
+            }}
+            
+            Focus on actionable UI elements like buttons, menus, forms, navigation items.
+            """
+            
+            content = [{"type": "text", "text": prompt}]
+            for base64_image in base64_images:
+                content.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{base64_image}",
+                        "detail": self.image_detail
+                    }
+                })
+            
+            response = await create_completion_with_retry_async(
+                client,
+                rate_limiter=self.rate_limiter,
+                estimated_tokens=estimate_request_tokens(
+                    prompt, max_tokens=500 * len(sentences), images=len(sentences), detail=self.image_detail
+                ),
+                model=self.vision_model,
+                messages=[{"role": "user", "content": content}],
+                max_tokens=500 * len(sentences),
+                response_format=BATCH_ANALYSIS_RESPONSE_FORMAT
+            )
+            
+            # The schema fixes each item's shape but not how many there are
+            analyses = json.loads(response.choices[0].message.content)['analyses']
+            if len(analyses) != len(sentences):
+                print(f"  Batch response did not contain {len(sentences)} analyses")
+                return None
+            
+            return analyses
+            
+        except Exception as e:
+            print(f"Error analyzing screenshot batch: {e}")
+            return None
+    
+    def _analysis_cache_key(self, image_path: Path) -> Optional[str]:
+        """Key a screenshot's analysis by its content, model and prompt version"""
+        digest = compute_file_digest(str(image_path))
+        if digest is None:
+            return None
+        return f"{self.vision_model}:{self.analysis_prompt_version}:{digest}"
+    
+    def _load_analysis_cache(self, cache_path: Path) -> Dict:
+        """Load analyses saved by earlier runs"""
+        if cache_path.exists():
+            try:
+                with open(cache_path, 'rb') as f:
+                    return orjson.loads(f.read())
+            except (OSError, orjson.JSONDecodeError) as e:
+                print(f"Warning: Could not load analysis cache {cache_path}: {e}")
+        return {}
+    
+    def _save_analysis_cache(self, cache_path: Path):
+        """Save analyses so unchanged screenshots are not re-analyzed next run"""
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, 'wb') as f:
+            f.write(orjson.dumps(self.analysis_cache))
+    
+    def _encode_image(self, image_path: Path, address_bar_only: bool = False) -> str:
+        """Downscale and re-encode image as JPEG, then base64 for OpenAI Vision API"""
+        # Keyed on mtime so a rewritten screenshot is never served stale
+        return _encode_image_cached(
+            str(image_path),
+            image_path.stat().st_mtime_ns,
+            self.max_image_size,
+            self.jpeg_quality,
+            self.address_bar_region if address_bar_only else None
+        )
     
     def _create_empty_analysis(self) -> Dict:
         """Create empty analysis structure for failed cases"""
@@ -279,38 +559,64 @@ class AIAnalyzer:
             "interaction_context": ""
         }
     
+    def _index_screenshot(self, index: BKTree, image_path: Path, item) -> None:
+        """Add a screenshot to a perceptual-hash index"""
+        image_hash = compute_phash(str(image_path))
+        if image_hash is not None:
+            index.add(image_hash, (image_path, item))
+    
+    def _find_similar_screenshot(self, index: BKTree, image_path: Path) -> Tuple[Optional[object], float]:
+        """
+        Find the closest indexed screenshot at or above the similarity threshold
+        
+        Clear matches are decided by Hamming distance alone; borderline distances
+        fall back to SSIM. Returns (item, similarity) or (None, 0.0).
+        """
+        image_hash = compute_phash(str(image_path))
+        if image_hash is None:
+            return None, 0.0
+        
+        for distance, (indexed_path, item) in index.find(image_hash, self.phash_borderline):
+            if distance <= self.phash_threshold:
+                similarity = 1.0 - distance / HASH_BITS
+            else:
+                similarity = self._calculate_image_similarity(image_path, indexed_path)
+            if similarity >= self.similarity_threshold:
+                return item, similarity
+        
+        return None, 0.0
+    
     def _calculate_image_similarity(self, img1_path: Path, img2_path: Path) -> float:
         """Calculate structural similarity between two images"""
         try:
-            # Load images
-            img1 = cv2.imread(str(img1_path))
-            img2 = cv2.imread(str(img2_path))
+            # Compare cached grayscale thumbnails instead of decoding full frames
+            gray1 = load_thumbnail(str(img1_path))
+            gray2 = load_thumbnail(str(img2_path))
             
-            if img1 is None or img2 is None:
+            if gray1 is None or gray2 is None:
                 return 0.0
             
-            # Convert to grayscale
-            gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-            gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
-            
-            # Resize to same dimensions if needed
-            if gray1.shape != gray2.shape:
-                h, w = min(gray1.shape[0], gray2.shape[0]), min(gray1.shape[1], gray2.shape[1])
-                gray1 = cv2.resize(gray1, (w, h))
-                gray2 = cv2.resize(gray2, (w, h))
-            
             # Calculate SSIM
-            similarity, _ = ssim(gray1, gray2, full=True)
-            return similarity
+            return structural_similarity(gray1, gray2)
             
         except Exception as e:
             print(f"Error calculating image similarity: {e}")
             return 0.0
     
-    def _find_unique_screenshots(self, sentences: List[Dict], base_output_dir: Path) -> List[Tuple[int, Dict]]:
-        """Find unique screenshots by comparing similarity, return list of (index, sentence) tuples"""
+    def _find_unique_screenshots(
+        self,
+        sentences: List[Dict],
+        base_output_dir: Path,
+        processed_images: BKTree,
+        seen_digests: set
+    ) -> List[Tuple[int, Dict]]:
+        """
+        Find unique screenshots by comparing similarity, return list of (index, sentence) tuples
+        
+        processed_images and seen_digests hold screenshots found unique so far (on any
+        page) and are updated in place.
+        """
         unique_screenshots = []
-        processed_images = []
         
         print(f"Analyzing {len(sentences)} screenshots for similarity...")
         
@@ -322,18 +628,21 @@ class AIAnalyzer:
             if not screenshot_path.exists():
                 continue
             
-            # Compare with all previously processed images
-            is_unique = True
-            for processed_path, _ in processed_images:
-                similarity = self._calculate_image_similarity(screenshot_path, processed_path)
-                if similarity >= self.similarity_threshold:
-                    print(f"  Screenshot {idx}: {similarity:.2%} similar to existing - SKIPPING")
-                    is_unique = False
-                    break
+            # Byte-identical to an earlier screenshot: no need to compare images
+            digest = compute_file_digest(str(screenshot_path))
+            if digest in seen_digests:
+                print(f"  Screenshot {idx}: identical to existing - SKIPPING")
+                continue
+            if digest is not None:
+                seen_digests.add(digest)
             
-            if is_unique:
+            # Look up near neighbours among previously processed images
+            match, similarity = self._find_similar_screenshot(processed_images, screenshot_path)
+            if match is not None:
+                print(f"  Screenshot {idx}: {similarity:.2%} similar to existing - SKIPPING")
+            else:
                 unique_screenshots.append((idx, sentence))
-                processed_images.append((screenshot_path, sentence))
+                self._index_screenshot(processed_images, screenshot_path, sentence)
                 print(f"  Screenshot {idx}: UNIQUE - will analyze")
         
         print(f"Found {len(unique_screenshots)} unique screenshots out of {len(sentences)} total")
@@ -354,28 +663,25 @@ class AIAnalyzer:
         representatives = {}  # similar_screenshot -> representative_screenshot
         files_to_delete = set()
         
-        processed_screenshots = []
+        processed_screenshots = BKTree()
         
         for screenshot in all_screenshots:
+            if screenshot in representatives:
+                continue
+            
             screenshot_path = base_output_dir / screenshot
             if not screenshot_path.exists():
                 continue
                 
             # Find if this screenshot is similar to any processed one
-            representative = screenshot
-            for processed_screenshot in processed_screenshots:
-                processed_path = base_output_dir / processed_screenshot
-                if processed_path.exists():
-                    similarity = self._calculate_image_similarity(screenshot_path, processed_path)
-                    if similarity >= self.similarity_threshold:
-                        representative = processed_screenshot
-                        files_to_delete.add(screenshot_path)
-                        break
+            representative, _ = self._find_similar_screenshot(processed_screenshots, screenshot_path)
+            if representative is None:
+                representative = screenshot
+                self._index_screenshot(processed_screenshots, screenshot_path, screenshot)
+            else:
+                files_to_delete.add(screenshot_path)
             
             representatives[screenshot] = representative
-            
-            if representative == screenshot:
-                processed_screenshots.append(screenshot)
         
         # Delete duplicate files
         deleted_count = 0
@@ -4,8 +4,43 @@ Audio Splitting Functions
 Split large audio files into manageable chunks for OpenAI API
 """
 
+import os
 from pathlib import Path
-from typing import List, Dict
+from typing import BinaryIO, List, Dict
+
+COPY_BUFFER_SIZE = 1024 * 1024  # Userspace buffer when the kernel cannot copy for us
+
+def _copy_range(src: BinaryIO, dst: BinaryIO, length: int, buffer: memoryview) -> int:
+    """
+    Copy up to length bytes from the current position of src to dst
+    
+    Uses os.copy_file_range so the data stays in the kernel, falling back to
+    a reusable buffer where it is unavailable (non-Linux, cross-filesystem).
+    
+    Returns:
+        Number of bytes copied (less than length only at end of file)
+    """
+    copied = 0
+    
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < length:
+                count = os.copy_file_range(src.fileno(), dst.fileno(), length - copied)
+                if count == 0:
+                    return copied
+                copied += count
+            return copied
+        except OSError:
+            # Both fds advance with the copy, so the fallback resumes where it stopped
+            pass
+    
+    while copied < length:
+        count = src.readinto(buffer[:min(len(buffer), length - copied)])
+        if not count:
+            break
+        dst.write(buffer[:count])
+        copied += count
+    return copied
 
 def split_audio_file(audio_path: Path, output_dir: Path, chunk_size_mb: int = 20) -> List[Path]:
     """
@@ -30,17 +65,19 @@ def split_audio_file(audio_path: Path, output_dir: Path, chunk_size_mb: int = 20
     chunk_paths = []
     chunk_num = 1
     
-    with open(audio_path, 'rb') as src:
-        while True:
-            chunk_data = src.read(chunk_size)
-            if not chunk_data:
-                break
-            
+    buffer = memoryview(bytearray(COPY_BUFFER_SIZE))
+    
+    with open(audio_path, 'rb', buffering=0) as src:
+        while src.tell() < file_size:
             chunk_path = output_dir / f"audio_chunk_{chunk_num}.mp3"
-            with open(chunk_path, 'wb') as dst:
-                dst.write(chunk_data)
+            with open(chunk_path, 'wb', buffering=0) as dst:
+                copied = _copy_range(src, dst, chunk_size, buffer)
+            
+            if copied == 0:
+                chunk_path.unlink()
+                break
             
-            actual_size = len(chunk_data) / (1024 * 1024)
+            actual_size = copied / (1024 * 1024)
             print(f"  Created chunk {chunk_num}: {actual_size:.1f} MB")
             chunk_paths.append(chunk_path)
             chunk_num += 1
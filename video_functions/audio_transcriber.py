@@ -4,24 +4,24 @@ Audio Transcription Functions
 Transcribe audio chunks using OpenAI Whisper API
 """
 
-import json
-import os
+import orjson
+import asyncio
 from pathlib import Path
 from typing import List, Dict, Optional
-from openai import OpenAI
-from dotenv import load_dotenv
+from openai import AsyncOpenAI
 
-load_dotenv()
+from .openai_client import SDK_MAX_RETRIES, UPLOAD_TIMEOUT, create_async_openai_client
 
 class AudioTranscriber:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    def __init__(self, max_concurrent_transcriptions: int = 4):
+        self.max_concurrent_transcriptions = max_concurrent_transcriptions
     
-    def transcribe_chunk(self, chunk_path: Path) -> Optional[Dict]:
+    async def transcribe_chunk(self, client: AsyncOpenAI, chunk_path: Path) -> Optional[Dict]:
         """
         Transcribe a single audio chunk
         
         Args:
+            client: Async OpenAI client to issue the request with
             chunk_path: Path to audio chunk file
         
         Returns:
@@ -32,24 +32,85 @@ class AudioTranscriber:
         
         try:
             with open(chunk_path, "rb") as audio_file:
-                transcription = self.client.audio.transcriptions.create(
+                transcription = await client.audio.transcriptions.create(
                     model="whisper-1",
                     file=audio_file,
                     response_format="verbose_json",
-                    timestamp_granularities=["word"]
+                    timestamp_granularities=["word"],
+                    timeout=UPLOAD_TIMEOUT  # ~20MB chunks; the chat-sized default is too short
                 )
             
             result = transcription.model_dump()
             duration = result.get('duration', 0)
             word_count = len(result.get('words', []))
             
-            print(f"  ✅ Duration: {duration:.1f}s ({duration/60:.1f} min), {word_count} words")
+            print(f"  ✅ {chunk_path.name} duration: {duration:.1f}s ({duration/60:.1f} min), {word_count} words")
             return result
             
         except Exception as e:
-            print(f"  ❌ Error: {e}")
+            print(f"  ❌ {chunk_path.name} error: {e}")
             return None
     
+    async def _transcribe_all_chunks(self, chunk_paths: List[Path], checkpoint_dir: Path) -> List[Optional[Dict]]:
+        """
+        Transcribe all chunks concurrently, returning results in chunk order
+        
+        Each result is checkpointed as soon as its request completes, so a rerun
+        after a crash or failed chunk only sends the chunks still missing.
+        """
+        checkpoint_dir.mkdir(exist_ok=True)
+        semaphore = asyncio.Semaphore(self.max_concurrent_transcriptions)
+        
+        async with create_async_openai_client() as client:
+            # Uploads are not wrapped in the shared retry loop; let the SDK retry them
+            client = client.with_options(max_retries=SDK_MAX_RETRIES)
+            
+            async def transcribe(chunk_path: Path) -> Optional[Dict]:
+                checkpoint = self._load_chunk_checkpoint(checkpoint_dir, chunk_path)
+                if checkpoint is not None:
+                    print(f"Reusing saved transcription of {chunk_path.name}")
+                    return checkpoint
+                
+                async with semaphore:
+                    result = await self.transcribe_chunk(client, chunk_path)
+                if result is not None:
+                    self._save_chunk_checkpoint(checkpoint_dir, chunk_path, result)
+                return result
+            
+            return await asyncio.gather(*(transcribe(chunk_path) for chunk_path in chunk_paths))
+    
+    def _chunk_source(self, chunk_path: Path) -> Dict:
+        """Identity of an audio chunk file; a re-split chunk no longer matches its checkpoint"""
+        stat = chunk_path.stat()
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    
+    def _load_chunk_checkpoint(self, checkpoint_dir: Path, chunk_path: Path) -> Optional[Dict]:
+        """Return the saved transcription of this exact chunk file, if any"""
+        checkpoint_path = checkpoint_dir / f"{chunk_path.stem}.json"
+        if not checkpoint_path.exists():
+            return None
+        
+        try:
+            checkpoint = orjson.loads(checkpoint_path.read_bytes())
+        except (OSError, orjson.JSONDecodeError) as e:
+            print(f"  Warning: Ignoring unreadable checkpoint {checkpoint_path}: {e}")
+            return None
+        
+        if checkpoint.get('source') != self._chunk_source(chunk_path):
+            return None
+        return checkpoint['transcription']
+    
+    def _save_chunk_checkpoint(self, checkpoint_dir: Path, chunk_path: Path, transcription: Dict):
+        """Save one chunk's transcription next to the identity of the file it came from"""
+        checkpoint_path = checkpoint_dir / f"{chunk_path.stem}.json"
+        try:
+            checkpoint_path.write_bytes(orjson.dumps({
+                'source': self._chunk_source(chunk_path),
+                'transcription': transcription
+            }))
+        except OSError as e:
+            print(f"  Warning: Could not write checkpoint {checkpoint_path}: {e}")
+    
     def transcribe_chunks(self, chunk_paths: List[Path], output_dir: Path) -> Dict:
         """
         Transcribe multiple audio chunks and combine results
@@ -64,15 +125,17 @@ class AudioTranscriber:
         output_dir.mkdir(exist_ok=True)
         
         all_words = []
-        full_text = ""
+        text_parts: List[str] = []
         total_duration = 0
         chunk_info = []
         
-        for i, chunk_path in enumerate(chunk_paths):
+        print(f"Transcribing {len(chunk_paths)} chunks ({self.max_concurrent_transcriptions} at a time)")
+        chunk_results = asyncio.run(self._transcribe_all_chunks(chunk_paths, output_dir / "chunk_transcriptions"))
+        
+        # Offsets depend on the durations of all earlier chunks, so combine in order
+        for i, (chunk_path, chunk_data) in enumerate(zip(chunk_paths, chunk_results)):
             print(f"\n--- Chunk {i+1}/{len(chunk_paths)} ---")
             
-            # Try to transcribe chunk
-            chunk_data = self.transcribe_chunk(chunk_path)
             if not chunk_data:
                 print(f"Skipping failed chunk {i+1}")
                 continue
@@ -96,33 +159,18 @@ class AudioTranscriber:
             for word in chunk_words:
                 word['start'] += total_duration
                 word['end'] += total_duration
-                all_words.append(word)
+            all_words.extend(chunk_words)
             
             # Combine text
-            if full_text and not full_text.endswith(' '):
-                full_text += " "
-            full_text += chunk_text
+            if chunk_text.strip():
+                text_parts.append(chunk_text.strip())
             
             # Update total duration
             total_duration += chunk_duration
-            
-            # Save intermediate result
-            intermediate_result = {
-                'text': full_text.strip(),
-                'words': all_words,
-                'duration': total_duration,
-                'chunks_completed': i + 1
-            }
-            
-            intermediate_path = output_dir / f"transcription_through_chunk_{i+1}.json"
-            with open(intermediate_path, 'w') as f:
-                json.dump(intermediate_result, f, indent=2)
-            
-            print(f"  Saved intermediate result")
         
         # Create final combined transcription
         final_result = {
-            'text': full_text.strip(),
+            'text': " ".join(text_parts),
             'words': all_words,
             'duration': total_duration,
             'total_chunks': len(chunk_paths),
@@ -132,8 +180,8 @@ class AudioTranscriber:
         
         # Save final result
         final_path = output_dir / "complete_transcription.json"
-        with open(final_path, 'w') as f:
-            json.dump(final_result, f, indent=2)
+        with open(final_path, 'wb') as f:
+            f.write(orjson.dumps(final_result, option=orjson.OPT_INDENT_2))
         
         print(f"\n🎉 Transcription complete!")
         print(f"Total duration: {total_duration:.1f}s ({total_duration/60:.1f} min)")
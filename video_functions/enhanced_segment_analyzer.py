@@ -2,52 +2,329 @@
 """
 Enhanced Segment Analysis - Gets full user narration for each visual segment
 and performs comprehensive AI analysis with proper naming conventions
+
+Run from the repository root as: python -m video_functions.enhanced_segment_analyzer
 """
 
+import io
 import json
+import orjson
 import base64
+import asyncio
+import argparse
+import hashlib
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Tuple
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from openai import AsyncOpenAI
+from PIL import Image
+
+from .image_hashing import compute_file_digest
+from .openai_client import SDK_MAX_RETRIES, UPLOAD_TIMEOUT, create_async_openai_client, create_completion_with_retry_async, get_openai_client
+from .rate_limiter import RateLimiter, estimate_request_tokens
+
+# Structured Outputs schema for one segment analysis; the API guarantees the
+# reply parses and carries every key
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+SEGMENT_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "segment_type_classification": {"type": "string"},
+        "comprehensive_segment_description": {"type": "string"},
+        "primary_purpose": {"type": "string"},
+        "key_ui_sections": _STRING_LIST,
+        "actionable_elements": _STRING_LIST,
+        "navigation_elements": _STRING_LIST,
+        "data_displayed": _STRING_LIST,
+        "user_workflow_context": {"type": "string"},
+        "unique_visual_identifiers": _STRING_LIST,
+        "demonstrated_functionality": _STRING_LIST
+    },
+    "required": [
+        "segment_type_classification",
+        "comprehensive_segment_description",
+        "primary_purpose",
+        "key_ui_sections",
+        "actionable_elements",
+        "navigation_elements",
+        "data_displayed",
+        "user_workflow_context",
+        "unique_visual_identifiers",
+        "demonstrated_functionality"
+    ],
+    "additionalProperties": False
+}
+
+SEGMENT_ANALYSIS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "segment_analysis", "strict": True, "schema": SEGMENT_ANALYSIS_SCHEMA}
+}
+
+BATCH_SEGMENT_ANALYSIS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "segment_analyses",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"analyses": {"type": "array", "items": SEGMENT_ANALYSIS_SCHEMA}},
+            "required": ["analyses"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# Sentence-era sitemap field names and their visual segment equivalents
+PAGE_FIELD_RENAMES = {
+    'start_sentence': 'start_segment',
+    'end_sentence': 'end_segment',
+    'sentences': 'visual_segments'
+}
+SEGMENT_FIELD_RENAMES = {
+    'sentence_id': 'segment_id',
+    'sentence': 'user_narration'
+}
+
+def _encoded_image_path(image_path: str, cache_dir: Path, max_image_size: Tuple[int, int], jpeg_quality: int) -> Optional[Path]:
+    """Cache file for a screenshot's downscaled JPEG, keyed by image content and encoding settings"""
+    digest = compute_file_digest(image_path)
+    if digest is None:
+        return None
+    width, height = max_image_size
+    return cache_dir / 'encoded' / f"{digest}_{width}x{height}_q{jpeg_quality}.jpg"
 
-load_dotenv()
+@lru_cache(maxsize=128)
+def _encode_image_cached(
+    image_path: str,
+    mtime_ns: int,
+    max_image_size: Tuple[int, int],
+    jpeg_quality: int,
+    cache_dir: Path,
+    refresh_cache: bool
+) -> str:
+    """
+    Encode an image once per (path, mtime, size, quality), reusing the JPEG from earlier runs
+    
+    Module-level so the cache holds only encoded images, not analyzer instances.
+    
+    Args:
+        image_path: Path to image file (str so results can be cached)
+        mtime_ns: Modification time, so a rewritten file is encoded again
+        max_image_size: Bounding box to downscale into
+        jpeg_quality: JPEG quality to re-encode at
+        cache_dir: Directory holding encoded JPEGs from earlier runs
+        refresh_cache: Re-encode even if an encoded JPEG is already on disk
+    
+    Returns:
+        Base64 JPEG
+    """
+    encoded_path = _encoded_image_path(image_path, cache_dir, max_image_size, jpeg_quality)
+    if encoded_path is not None and encoded_path.exists() and not refresh_cache:
+        return base64.b64encode(encoded_path.read_bytes()).decode('ascii')
+    
+    with Image.open(image_path) as img:
+        img = img.convert('RGB')
+        img.thumbnail(max_image_size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=jpeg_quality, optimize=True)
+    
+    if encoded_path is not None:
+        try:
+            encoded_path.parent.mkdir(parents=True, exist_ok=True)
+            encoded_path.write_bytes(buffer.getvalue())
+        except OSError as e:
+            print(f"  Warning: Could not write cache entry {encoded_path}: {e}")
+    
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
 
 class EnhancedSegmentAnalyzer:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    def __init__(
+        self,
+        max_concurrent_requests: int = 20,
+        max_requests_per_minute: int = 500,
+        max_tokens_per_minute: int = 30000,
+        cache_dir: Optional[Path] = None,
+        refresh_cache: bool = False
+    ):
+        self.max_concurrent_requests = max_concurrent_requests  # Tune to the account's rate limit tier
+        self.segments_per_request = 4  # Screenshots batched into one Vision call
+        self.rate_limiter = RateLimiter(max_requests_per_minute, max_tokens_per_minute)
+        self.vision_model = "gpt-4o"
+        self.analysis_prompt_version = 1  # Bump when the segment prompt changes to invalidate cached analyses
+        self.cache_dir = cache_dir or Path.home() / '.cache' / 'vector-data' / 'segments'
+        self.refresh_cache = refresh_cache  # Ignore (and overwrite) cached analyses
+        self.max_image_size = (1536, 1536)  # Same tile count as full-size frames, far smaller uploads
+        self.jpeg_quality = 85
     
     def analyze_visual_segments(self, sitemap_path: Path, output_path: Path = None) -> Dict:
         """Analyze visual segments with full user narration context and proper naming"""
+        sitemap, segments_to_analyze = self._collect_segments(sitemap_path)
+        
+        # Perform comprehensive segment analysis, many segments at a time
+        analyses = asyncio.run(self._analyze_all_segments(segments_to_analyze))
+        segment_analyses = {
+            screenshot: analysis
+            for (screenshot, _, _), analysis in zip(segments_to_analyze, analyses)
+        }
+        
+        return self._save_enhanced_sitemap(sitemap, segment_analyses, output_path)
+    
+    def analyze_visual_segments_batch(self, sitemap_path: Path, output_path: Path = None, poll_interval: float = 60.0) -> Dict:
+        """
+        Analyze visual segments through the OpenAI Batch API
+        
+        Batch requests cost half as much and draw on a separate rate limit
+        pool, but may take up to 24 hours to complete - use this for offline
+        runs over large sitemaps.
         
-        with open(sitemap_path) as f:
-            sitemap = json.load(f)
+        Args:
+            sitemap_path: Path to the sitemap JSON
+            output_path: Where to write the enhanced sitemap
+            poll_interval: Seconds between batch status checks
         
-        # Load complete transcription for user narration
+        Returns:
+            Enhanced sitemap
+        """
+        sitemap, segments_to_analyze = self._collect_segments(sitemap_path)
+        
+        segment_analyses = {}
+        pending = {}
+        for screenshot, screenshot_path, segment_context in segments_to_analyze:
+            cached_analysis = self._load_cached_analysis(screenshot_path, segment_context)
+            if cached_analysis is not None:
+                segment_analyses[screenshot] = cached_analysis
+            else:
+                pending[screenshot] = (screenshot_path, segment_context)
+        
+        if len(pending) < len(segments_to_analyze):
+            print(f"Reusing {len(segments_to_analyze) - len(pending)} cached segment analyses")
+        
+        if pending:
+            segment_analyses.update(self._run_segment_batch_job(pending, poll_interval))
+        
+        # Keep the sitemap's screenshot order regardless of completion order
+        segment_analyses = {
+            screenshot: segment_analyses[screenshot]
+            for screenshot, _, _ in segments_to_analyze
+        }
+        
+        return self._save_enhanced_sitemap(sitemap, segment_analyses, output_path)
+    
+    def _run_segment_batch_job(self, pending: Dict[str, Tuple[Path, Dict]], poll_interval: float) -> Dict[str, Dict]:
+        """
+        Submit one Batch API job for the given segments and wait for its results
+        
+        Args:
+            pending: screenshot -> (screenshot_path, segment_context)
+            poll_interval: Seconds between batch status checks
+        
+        Returns:
+            Dictionary of screenshot -> analysis (error analyses for failed requests)
+        """
+        # Batch job calls are not wrapped in the shared retry loop; let the SDK retry them
+        client = get_openai_client().with_options(max_retries=SDK_MAX_RETRIES)
+        
+        # One chat completion request per screenshot, matched back up by custom_id
+        request_lines = []
+        for screenshot, (screenshot_path, segment_context) in pending.items():
+            request_lines.append(json.dumps({
+                "custom_id": screenshot,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self._build_segment_request(
+                    self._build_segment_prompt(segment_context),
+                    self._encode_image(screenshot_path)
+                )
+            }))
+        
+        batch_input = client.files.create(
+            file=("segment_analysis_requests.jsonl", "\n".join(request_lines).encode()),
+            purpose="batch",
+            timeout=UPLOAD_TIMEOUT  # One base64 image per request line
+        )
+        batch = client.batches.create(
+            input_file_id=batch_input.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        print(f"Submitted batch {batch.id} with {len(request_lines)} segment requests")
+        
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(poll_interval)
+            batch = client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            if counts:
+                print(f"  Batch {batch.status}: {counts.completed}/{counts.total} done, {counts.failed} failed")
+            else:
+                print(f"  Batch {batch.status}")
+        
+        # Expired batches still return the requests that finished in time
+        results = {}
+        if batch.output_file_id:
+            for line in client.files.content(batch.output_file_id).text.splitlines():
+                if line.strip():
+                    result = json.loads(line)
+                    results[result['custom_id']] = result
+        else:
+            print(f"Batch {batch.id} ended as {batch.status} without output")
+        
+        segment_analyses = {}
+        for screenshot, (screenshot_path, segment_context) in pending.items():
+            result = results.get(screenshot)
+            try:
+                if result is None:
+                    raise RuntimeError(f"no result in batch {batch.id} ({batch.status})")
+                response = result.get('response') or {}
+                if response.get('status_code') != 200:
+                    raise RuntimeError(result.get('error') or f"status {response.get('status_code')}: {response.get('body')}")
+                
+                analysis = json.loads(response['body']['choices'][0]['message']['content'])
+                self._save_cached_analysis(self._segment_cache_path(screenshot_path), analysis)
+                analysis['segment_context'] = segment_context  # Include full context for reference
+            except Exception as e:
+                print(f"Error analyzing segment {screenshot_path}: {e}")
+                analysis = self._create_error_analysis(e, segment_context)
+            segment_analyses[screenshot] = analysis
+        
+        return segment_analyses
+    
+    def _collect_segments(self, sitemap_path: Path) -> Tuple[Dict, List[Tuple[str, Path, Dict]]]:
+        """
+        Load the sitemap and gather each unique screenshot's full context
+        
+        Returns:
+            Sitemap and (screenshot, screenshot_path, segment_context) tuples to analyze
+        """
+        # Load the sitemap and the complete transcription (for user narration) side by side
         transcription_path = Path('video_processing/transcription_output/complete_transcription.json')
-        with open(transcription_path) as f:
-            transcription = json.load(f)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            sitemap_future = executor.submit(lambda: orjson.loads(Path(sitemap_path).read_bytes()))
+            transcription_future = executor.submit(lambda: orjson.loads(transcription_path.read_bytes()))
+            sitemap, transcription = sitemap_future.result(), transcription_future.result()
         
         screenshots_dir = Path('video_final_data/screenshots_web_full')
+        word_index = self._build_word_index(transcription)
         
-        # Get all unique screenshots
-        unique_screenshots = set()
+        # Index every use of each unique screenshot in one pass over the sitemap
+        screenshot_index: Dict[str, List[Tuple[Dict, Dict]]] = defaultdict(list)
         for page in sitemap.get('pages', []):
             for sentence in page.get('visual_segments', page.get('sentences', [])):
                 if sentence.get('screenshot'):
-                    unique_screenshots.add(sentence['screenshot'])
+                    screenshot_index[sentence['screenshot']].append((page, sentence))
+        unique_screenshots = list(screenshot_index)
         
         print(f"Analyzing {len(unique_screenshots)} unique visual segments...")
         
-        # Analyze each unique screenshot with full context
-        segment_analyses = {}
+        # Gather each unique screenshot's full context before making any API calls
+        segments_to_analyze = []
         
-        for i, screenshot in enumerate(unique_screenshots):
-            print(f"Analyzing segment {i+1}/{len(unique_screenshots)}: {screenshot}")
-            
+        for screenshot in unique_screenshots:
             # Remove path prefix if present
-            screenshot_file = screenshot.replace('screenshots_web_full/', '') if screenshot.startswith('screenshots_web_full/') else screenshot
+            screenshot_file = screenshot.removeprefix('screenshots_web_full/')
             screenshot_path = screenshots_dir / screenshot_file
             
             if not screenshot_path.exists():
@@ -55,45 +332,34 @@ class EnhancedSegmentAnalyzer:
                 continue
             
             # Get full segment context including complete user narration
-            segment_context = self._extract_full_segment_context(screenshot, sitemap, transcription)
-            
-            # Perform comprehensive segment analysis
-            analysis = self._analyze_visual_segment(screenshot_path, segment_context)
-            segment_analyses[screenshot] = analysis
+            segment_context = self._extract_full_segment_context(screenshot_index[screenshot], word_index)
+            segments_to_analyze.append((screenshot, screenshot_path, segment_context))
         
+        return sitemap, segments_to_analyze
+    
+    def _save_enhanced_sitemap(self, sitemap: Dict, segment_analyses: Dict, output_path: Optional[Path]) -> Dict:
+        """Apply the analyses to the sitemap and write the result"""
         # Apply analyses with proper naming conventions
         enhanced_sitemap = self._apply_segment_analyses_with_proper_naming(sitemap, segment_analyses)
         
         # Save enhanced sitemap with proper naming
         if output_path is None:
             output_path = Path('video_final_data/web_full_site_map_enhanced_segments.json')
-        with open(output_path, 'w') as f:
-            json.dump(enhanced_sitemap, f, indent=2)
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(enhanced_sitemap, option=orjson.OPT_INDENT_2))
         
         print(f"Enhanced segment analysis complete: {output_path}")
         return enhanced_sitemap
     
-    def _extract_full_segment_context(self, screenshot: str, sitemap: Dict, transcription: Dict) -> Dict:
-        """Extract complete user narration and context for a specific visual segment"""
-        
-        # Find primary instance and count usage
-        primary_page = None
-        primary_url = None
-        primary_start = None
-        primary_end = None
-        usage_count = 0
+    def _extract_full_segment_context(self, usages: List[Tuple[Dict, Dict]], word_index: Tuple[List[str], np.ndarray, np.ndarray]) -> Dict:
+        """
+        Extract complete user narration and context for a specific visual segment
         
-        for page in sitemap.get('pages', []):
-            for sentence in page.get('visual_segments', page.get('sentences', [])):
-                if sentence.get('screenshot') == screenshot:
-                    usage_count += 1
-                    if primary_page is None:  # First occurrence
-                        primary_page = page.get('page_name')
-                        primary_url = page.get('relative_url')
-                        primary_start = sentence.get('start_timestamp')
-                        primary_end = sentence.get('end_timestamp')
-        
-        if primary_page is None:
+        Args:
+            usages: (page, segment) pairs that show the screenshot, in sitemap order
+            word_index: Word texts, start times and end times from _build_word_index
+        """
+        if not usages:
             return {
                 'full_user_narration': '',
                 'usage_count': 0,
@@ -101,9 +367,17 @@ class EnhancedSegmentAnalyzer:
                 'primary_url': 'unknown'
             }
         
+        # The first occurrence is the primary instance
+        page, sentence = usages[0]
+        primary_page = page.get('page_name')
+        primary_url = page.get('relative_url')
+        primary_start = sentence.get('start_timestamp')
+        primary_end = sentence.get('end_timestamp')
+        usage_count = len(usages)
+        
         # Extract full user narration around this timestamp from complete transcription
         full_narration = self._get_full_narration_for_timespan(
-            transcription,
+            word_index,
             primary_start,
             primary_end
         )
@@ -115,200 +389,381 @@ class EnhancedSegmentAnalyzer:
             'primary_url': primary_url
         }
     
-    def _get_full_narration_for_timespan(self, transcription: Dict, start_time: float, end_time: float) -> str:
-        """Extract all user narration within a timespan from complete transcription"""
-        
+    def _build_word_index(self, transcription: Dict) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """Split transcription words into a text list and start/end time arrays for searching"""
         words = transcription.get('words', [])
-        relevant_words = []
+        return (
+            [word_data.get('word', '') for word_data in words],
+            np.fromiter((word_data.get('start', 0) for word_data in words), dtype=np.float64, count=len(words)),
+            np.fromiter((word_data.get('end', 0) for word_data in words), dtype=np.float64, count=len(words))
+        )
+    
+    def _get_full_narration_for_timespan(self, word_index: Tuple[List[str], np.ndarray, np.ndarray], start_time: float, end_time: float) -> str:
+        """Extract all user narration within a timespan from complete transcription"""
+        word_texts, word_starts, word_ends = word_index
         
         # Add some buffer around the timespan to get more context
         buffer_seconds = 5.0
         expanded_start = max(0, start_time - buffer_seconds)
         expanded_end = end_time + buffer_seconds
         
-        for word_data in words:
-            word_start = word_data.get('start', 0)
-            word_end = word_data.get('end', 0)
-            
-            # Include word if it overlaps with our expanded timespan
-            if (word_start <= expanded_end and word_end >= expanded_start):
-                relevant_words.append(word_data.get('word', ''))
+        # Words are in time order, so the ones overlapping the expanded timespan
+        # run from the first that ends after its start to the last that starts before its end
+        first = int(np.searchsorted(word_ends, expanded_start, side='left'))
+        last = int(np.searchsorted(word_starts, expanded_end, side='right'))
         
-        return ' '.join(relevant_words).strip()
+        return ' '.join(word_texts[first:last]).strip()
     
-    def _analyze_visual_segment(self, screenshot_path: Path, segment_context: Dict) -> Dict:
-        """Analyze a visual segment with complete user narration context"""
-        try:
-            base64_image = self._encode_image(screenshot_path)
-            
-            # Create comprehensive prompt with full user narration
-            primary_page = segment_context['primary_page']
-            primary_url = segment_context['primary_url']
-            full_narration = segment_context['full_user_narration']
-            usage_count = segment_context['usage_count']
+    async def _analyze_all_segments(self, segments: List[Tuple[str, Path, Dict]]) -> List[Dict]:
+        """Analyze all segments concurrently under one client and request cap"""
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        
+        async with create_async_openai_client() as client:
+            async def analyze(i: int, screenshot: str, screenshot_path: Path, segment_context: Dict) -> Dict:
+                async with semaphore:
+                    print(f"Analyzing segment {i+1}/{len(segments)}: {screenshot}")
+                    return await self._analyze_visual_segment(client, screenshot_path, segment_context)
             
-            prompt = f"""
-            VISUAL SEGMENT ANALYSIS
+            async def analyze_batch(batch: List[Tuple[int, Tuple[str, Path, Dict]]]) -> List[Dict]:
+                if len(batch) == 1:
+                    i, segment = batch[0]
+                    return [await analyze(i, *segment)]
+                
+                async with semaphore:
+                    print(f"Analyzing segments {[i + 1 for i, _ in batch]}/{len(segments)}")
+                    analyses = await self._analyze_visual_segment_batch(
+                        client, [segment[1:] for _, segment in batch]
+                    )
+                
+                if analyses is None:
+                    # Batch response unusable - analyze each segment on its own
+                    analyses = await asyncio.gather(*(analyze(i, *segment) for i, segment in batch))
+                return analyses
             
-            You are analyzing a screenshot from a user demonstration video. The user was explaining the application while navigating through it.
+            # Segments analyzed in an earlier run skip the API entirely
+            results: List[Optional[Dict]] = [None] * len(segments)
+            uncached = []
+            for i, (screenshot, screenshot_path, segment_context) in enumerate(segments):
+                results[i] = self._load_cached_analysis(screenshot_path, segment_context)
+                if results[i] is None:
+                    uncached.append((i, (screenshot, screenshot_path, segment_context)))
             
-            SEGMENT CONTEXT:
-            - Primary Page: {primary_page}
-            - URL: {primary_url}
-            - Used {usage_count} times in video
-            - Timestamp: {segment_context.get('timestamp_range', {}).get('start', 'unknown')}s - {segment_context.get('timestamp_range', {}).get('end', 'unknown')}s
+            if len(uncached) < len(segments):
+                print(f"Reusing {len(segments) - len(uncached)} cached segment analyses")
             
-            COMPLETE USER NARRATION:
-            "{full_narration}"
+            batch_size = self.segments_per_request
+            batches = [uncached[i:i + batch_size] for i in range(0, len(uncached), batch_size)]
+            batch_results = await asyncio.gather(*(analyze_batch(batch) for batch in batches))
             
-            TASK:
-            Analyze this screenshot as a distinct visual segment, using the user's complete narration to understand what they were demonstrating.
+            for batch, analyses in zip(batches, batch_results):
+                for (i, _), analysis in zip(batch, analyses):
+                    results[i] = analysis
             
-            Provide a JSON response with:
-            {{
-                "segment_type_classification": "What type of UI state/screen this represents (e.g., 'Calendar Grid View', 'Workout Detail Modal', 'Settings Panel')",
-                "comprehensive_segment_description": "Detailed description of this specific visual state, incorporating what the user was explaining",
-                "primary_purpose": "What the user was demonstrating or explaining in this segment",
-                "key_ui_sections": ["visible UI sections in this state"],
-                "actionable_elements": ["specific interactive elements visible"],
-                "navigation_elements": ["menus, tabs, breadcrumbs visible"],
-                "data_displayed": ["types of information shown"],
-                "user_workflow_context": "What step in the user's demonstration this represents",
-                "unique_visual_identifiers": ["distinguishing visual features of this segment"],
-                "demonstrated_functionality": ["specific features the user was showing"]
-            }}
+            return results
+    
+    async def _analyze_visual_segment(self, client: AsyncOpenAI, screenshot_path: Path, segment_context: Dict) -> Dict:
+        """Analyze a visual segment with complete user narration context (callers skip cached segments)"""
+        cache_path = self._segment_cache_path(screenshot_path)
+        
+        try:
+            base64_image = await asyncio.to_thread(self._encode_image, screenshot_path)
             
-            Focus on this SPECIFIC visual state and what the user was explaining about it.
-            """
+            prompt = self._build_segment_prompt(segment_context)
             
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=1000
+            response = await create_completion_with_retry_async(
+                client,
+                rate_limiter=self.rate_limiter,
+                estimated_tokens=estimate_request_tokens(prompt, max_tokens=1000),
+                **self._build_segment_request(prompt, base64_image)
             )
             
-            # Parse JSON response
-            content = response.choices[0].message.content
-            try:
-                # Clean up response
-                if content.startswith('```json'):
-                    content = content.replace('```json', '').replace('```', '').strip()
-                elif content.startswith('```'):
-                    content = content.replace('```', '').strip()
-                
-                analysis = json.loads(content)
-                analysis['segment_context'] = segment_context  # Include full context for reference
-            except json.JSONDecodeError:
-                # Fallback
-                analysis = {
-                    "segment_type_classification": "Analysis Failed",
-                    "comprehensive_segment_description": content,
-                    "primary_purpose": "JSON parsing failed",
-                    "key_ui_sections": [],
-                    "actionable_elements": [],
-                    "navigation_elements": [],
-                    "data_displayed": [],
-                    "user_workflow_context": "Unknown",
-                    "unique_visual_identifiers": [],
-                    "demonstrated_functionality": [],
-                    "segment_context": segment_context
-                }
+            # Truncated (max_tokens) or refused replies raise here and take the error path
+            analysis = json.loads(response.choices[0].message.content)
+            self._save_cached_analysis(cache_path, analysis)
+            analysis['segment_context'] = segment_context  # Include full context for reference
             
             return analysis
             
         except Exception as e:
             print(f"Error analyzing segment {screenshot_path}: {e}")
-            return {
-                "segment_type_classification": "Error",
-                "comprehensive_segment_description": f"Analysis failed: {str(e)}",
-                "primary_purpose": "Error",
-                "key_ui_sections": [],
-                "actionable_elements": [],
-                "navigation_elements": [],
-                "data_displayed": [],
-                "user_workflow_context": "Error",
-                "unique_visual_identifiers": [],
-                "demonstrated_functionality": [],
-                "segment_context": segment_context
-            }
+            return self._create_error_analysis(e, segment_context)
+    
+    def _build_segment_prompt(self, segment_context: Dict) -> str:
+        """Create comprehensive prompt with full user narration"""
+        primary_page = segment_context['primary_page']
+        primary_url = segment_context['primary_url']
+        full_narration = segment_context['full_user_narration']
+        usage_count = segment_context['usage_count']
+        
+        prompt = f"""
+        VISUAL SEGMENT ANALYSIS
+        
+        You are analyzing a screenshot from a user demonstration video. The user was explaining the application while navigating through it.
+        
+        SEGMENT CONTEXT:
+        - Primary Page: {primary_page}
+        - URL: {primary_url}
+        - Used {usage_count} times in video
+        - Timestamp: {segment_context.get('timestamp_range', {}).get('start', 'unknown')}s - {segment_context.get('timestamp_range', {}).get('end', 'unknown')}s
+        
+        COMPLETE USER NARRATION:
+        "{full_narration}"
+        
+        TASK:
+        Analyze this screenshot as a distinct visual segment, using the user's complete narration to understand what they were demonstrating.
+        
+        Provide a JSON response with:
+        {{
+            "segment_type_classification": "What type of UI state/screen this represents (e.g., 'Calendar Grid View', 'Workout Detail Modal', 'Settings Panel')",
+            "comprehensive_segment_description": "Detailed description of this specific visual state, incorporating what the user was explaining",
+            "primary_purpose": "What the user was demonstrating or explaining in this segment",
+            "key_ui_sections": ["visible UI sections in this state"],
+            "actionable_elements": ["specific interactive elements visible"],
+            "navigation_elements": ["menus, tabs, breadcrumbs visible"],
+            "data_displayed": ["types of information shown"],
+            "user_workflow_context": "What step in the user's demonstration this represents",
+            "unique_visual_identifiers": ["distinguishing visual features of this segment"],
+            "demonstrated_functionality": ["specific features the user was showing"]
+        }}
+        
+        Focus on this SPECIFIC visual state and what the user was explaining about it.
+        """
+        
+        return prompt
+    
+    def _build_segment_request(self, prompt: str, base64_image: str) -> Dict:
+        """Chat completion arguments for one segment, shared by live and Batch API requests"""
+        return {
+            "model": self.vision_model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": prompt
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{base64_image}"
+                            }
+                        }
+                    ]
+                }
+            ],
+            "max_tokens": 1000,
+            "response_format": SEGMENT_ANALYSIS_RESPONSE_FORMAT
+        }
     
     def _apply_segment_analyses_with_proper_naming(self, sitemap: Dict, segment_analyses: Dict) -> Dict:
         """Apply segment analyses to sitemap with proper naming conventions"""
-        enhanced_sitemap = sitemap.copy()
-        
         # Fix naming at processing info level
-        processing_info = enhanced_sitemap.get('processing_info', {})
-        processing_info['total_visual_segments'] = processing_info.pop('total_sentences', 0)
+        processing_info = {
+            key: value for key, value in sitemap.get('processing_info', {}).items()
+            if key != 'total_sentences'
+        }
+        processing_info['total_visual_segments'] = sitemap.get('processing_info', {}).get('total_sentences', 0)
         processing_info['include_ai_analysis'] = True
         processing_info['ai_analysis_type'] = 'enhanced_segment_level'
         processing_info['enhancement_method'] = 'Full User Narration Context Analysis'
         
-        # Fix naming at page level and apply analyses
-        for page in enhanced_sitemap.get('pages', []):
-            # Rename page-level fields
-            if 'start_sentence' in page:
-                page['start_segment'] = page.pop('start_sentence')
-            if 'end_sentence' in page:
-                page['end_segment'] = page.pop('end_sentence')
-            if 'sentences' in page:
-                page['visual_segments'] = page.pop('sentences')
-            
-            # Fix naming and apply analyses to visual segments
-            for segment in page.get('visual_segments', []):
-                # Rename segment-level fields
-                if 'sentence_id' in segment:
-                    segment['segment_id'] = segment.pop('sentence_id')
-                if 'sentence' in segment:
-                    segment['user_narration'] = segment.pop('sentence')
-                
-                # Apply segment analysis with proper naming
-                screenshot = segment.get('screenshot')
-                if screenshot and screenshot in segment_analyses:
-                    segment['segment_analysis'] = segment_analyses[screenshot]
-                    
-                    # Add the original user text from this specific segment to the analysis
-                    original_user_text = segment.get('user_narration', '')
-                    segment['segment_analysis']['original_user_text'] = original_user_text
-                else:
-                    segment['segment_analysis'] = self._create_empty_analysis()
-                    segment['segment_analysis']['original_user_text'] = segment.get('user_narration', '')
-        
         # Create segment states summary with proper naming
-        enhanced_sitemap['unique_segment_states'] = {
-            'total_unique_segments': len(segment_analyses),
-            'segment_types': []
-        }
-        
-        for screenshot, analysis in segment_analyses.items():
-            enhanced_sitemap['unique_segment_states']['segment_types'].append({
+        segment_types = [
+            {
                 'screenshot': screenshot,
                 'segment_type': analysis.get('segment_type_classification', 'Unknown'),
                 'primary_purpose': analysis.get('primary_purpose', 'Unknown'),
                 'usage_count': analysis.get('segment_context', {}).get('usage_count', 0)
-            })
+            }
+            for screenshot, analysis in segment_analyses.items()
+        ]
         
-        return enhanced_sitemap
+        # Build renamed pages and segments directly rather than popping keys off the loaded ones
+        return {
+            **sitemap,
+            'processing_info': processing_info,
+            'pages': [self._rename_page(page, segment_analyses) for page in sitemap.get('pages', [])],
+            'unique_segment_states': {
+                'total_unique_segments': len(segment_analyses),
+                'segment_types': segment_types
+            }
+        }
+    
+    def _rename_page(self, page: Dict, segment_analyses: Dict) -> Dict:
+        """Copy a page with segment naming, applying analyses to its visual segments"""
+        renamed_page = {PAGE_FIELD_RENAMES.get(key, key): value for key, value in page.items()}
+        if 'visual_segments' in renamed_page:
+            renamed_page['visual_segments'] = [
+                self._rename_segment(segment, segment_analyses)
+                for segment in renamed_page['visual_segments']
+            ]
+        return renamed_page
+    
+    def _rename_segment(self, segment: Dict, segment_analyses: Dict) -> Dict:
+        """Copy a segment with segment naming and its screenshot's analysis attached"""
+        renamed_segment = {SEGMENT_FIELD_RENAMES.get(key, key): value for key, value in segment.items()}
+        
+        screenshot = renamed_segment.get('screenshot')
+        if screenshot and screenshot in segment_analyses:
+            analysis = segment_analyses[screenshot]
+        else:
+            analysis = self._create_empty_analysis()
+        
+        # Screenshots shared by several segments share one analysis, so copy it
+        # before adding the original user text from this specific segment
+        renamed_segment['segment_analysis'] = {
+            **analysis,
+            'original_user_text': renamed_segment.get('user_narration', '')
+        }
+        return renamed_segment
+    
+    async def _analyze_visual_segment_batch(self, client: AsyncOpenAI, segments: List[Tuple[Path, Dict]]) -> Optional[List[Dict]]:
+        """
+        Analyze several visual segments in a single Vision request
+        
+        Args:
+            client: Async OpenAI client
+            segments: (screenshot_path, segment_context) pairs
+        
+        Returns:
+            One analysis per segment in order, or None if the response could not be used
+        """
+        try:
+            base64_images = await asyncio.gather(*(
+                asyncio.to_thread(self._encode_image, screenshot_path) for screenshot_path, _ in segments
+            ))
+            
+            segment_blocks = "\n".join(
+                f"""
+            SCREENSHOT {number}:
+            - Primary Page: {segment_context['primary_page']}
+            - URL: {segment_context['primary_url']}
+            - Used {segment_context['usage_count']} times in video
+            - Complete user narration: "{segment_context['full_user_narration']}"
+            """
+                for number, (_, segment_context) in enumerate(segments, 1)
+            )
+            
+            prompt = f"""
+            VISUAL SEGMENT ANALYSIS
+            
+            You are analyzing {len(segments)} screenshots from a user demonstration video, numbered 1..{len(segments)} in the order attached. The user was explaining the application while navigating through it.
+            {segment_blocks}
+            TASK:
+            Analyze each screenshot as a distinct visual segment, using that screenshot's narration to understand what the user was demonstrating.
+            
+            Provide a JSON response with an "analyses" array holding one object per screenshot, in the same order, each with:
+            - segment_type_classification: What type of UI state/screen this represents (e.g., 'Calendar Grid View', 'Workout Detail Modal', 'Settings Panel')
+            - comprehensive_segment_description: Detailed description of this specific visual state, incorporating what the user was explaining
+            - primary_purpose: What the user was demonstrating or explaining in this segment
+            - key_ui_sections: visible UI sections in this state
+            - actionable_elements: specific interactive elements visible
+            - navigation_elements: menus, tabs, breadcrumbs visible
+            - data_displayed: types of information shown
+            - user_workflow_context: What step in the user's demonstration this represents
+            - unique_visual_identifiers: distinguishing visual features of this segment
+            - demonstrated_functionality: specific features the user was showing
+            """
+            
+            content = [{"type": "text", "text": prompt}]
+            for base64_image in base64_images:
+                content.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{base64_image}"
+                    }
+                })
+            
+            response = await create_completion_with_retry_async(
+                client,
+                rate_limiter=self.rate_limiter,
+                estimated_tokens=estimate_request_tokens(prompt, max_tokens=1000 * len(segments), images=len(segments)),
+                model=self.vision_model,
+                messages=[{"role": "user", "content": content}],
+                max_tokens=1000 * len(segments),
+                response_format=BATCH_SEGMENT_ANALYSIS_RESPONSE_FORMAT
+            )
+            
+            # The schema fixes each item's shape but not how many there are
+            analyses = json.loads(response.choices[0].message.content)['analyses']
+            if len(analyses) != len(segments):
+                print(f"  Batch response did not contain {len(segments)} analyses")
+                return None
+            
+            for (screenshot_path, segment_context), analysis in zip(segments, analyses):
+                self._save_cached_analysis(self._segment_cache_path(screenshot_path), analysis)
+                analysis['segment_context'] = segment_context  # Include full context for reference
+            
+            return analyses
+            
+        except Exception as e:
+            print(f"Error analyzing segment batch: {e}")
+            return None
+    
+    def _load_cached_analysis(self, screenshot_path: Path, segment_context: Dict) -> Optional[Dict]:
+        """Return the cached analysis of a screenshot with this run's context attached, if any"""
+        if self.refresh_cache:
+            return None
+        
+        cache_path = self._segment_cache_path(screenshot_path)
+        if cache_path is None or not cache_path.exists():
+            return None
+        
+        try:
+            analysis = orjson.loads(cache_path.read_bytes())
+        except (OSError, orjson.JSONDecodeError) as e:
+            print(f"  Warning: Ignoring unreadable cache entry {cache_path}: {e}")
+            return None
+        
+        analysis['segment_context'] = segment_context
+        return analysis
+    
+    def _segment_cache_path(self, screenshot_path: Path) -> Optional[Path]:
+        """Cache file for a screenshot's analysis, keyed by image content, model and prompt version"""
+        digest = compute_file_digest(str(screenshot_path))
+        if digest is None:
+            return None
+        key = hashlib.sha256(f"{digest}:{self.vision_model}:{self.analysis_prompt_version}".encode()).hexdigest()
+        return self.cache_dir / f"{key}.json"
+    
+    def _save_cached_analysis(self, cache_path: Optional[Path], analysis: Dict):
+        """Store a successful analysis (without the per-run segment context)"""
+        if cache_path is None:
+            return
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            cache_path.write_bytes(orjson.dumps(analysis))
+        except OSError as e:
+            print(f"  Warning: Could not write cache entry {cache_path}: {e}")
     
     def _encode_image(self, image_path: Path) -> str:
-        """Encode image to base64"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        """Downscale and re-encode image as JPEG, then base64 for OpenAI Vision API"""
+        # Keyed on mtime so a rewritten screenshot is never served stale
+        return _encode_image_cached(
+            str(image_path),
+            image_path.stat().st_mtime_ns,
+            self.max_image_size,
+            self.jpeg_quality,
+            self.cache_dir,
+            self.refresh_cache
+        )
+    
+    def _create_error_analysis(self, error: Exception, segment_context: Dict) -> Dict:
+        """Create the analysis recorded for a segment whose request failed"""
+        return {
+            "segment_type_classification": "Error",
+            "comprehensive_segment_description": f"Analysis failed: {str(error)}",
+            "primary_purpose": "Error",
+            "key_ui_sections": [],
+            "actionable_elements": [],
+            "navigation_elements": [],
+            "data_displayed": [],
+            "user_workflow_context": "Error",
+            "unique_visual_identifiers": [],
+            "demonstrated_functionality": [],
+            "segment_context": segment_context
+        }
     
     def _create_empty_analysis(self) -> Dict:
         """Create empty analysis structure with proper naming"""
@@ -326,9 +781,17 @@ class EnhancedSegmentAnalyzer:
         }
 
 def main():
-    analyzer = EnhancedSegmentAnalyzer()
+    parser = argparse.ArgumentParser(description="Analyze visual segments with full user narration context")
+    parser.add_argument("--refresh-cache", action="store_true", help="Re-analyze screenshots even if a cached analysis exists")
+    parser.add_argument("--batch-api", action="store_true", help="Submit through the OpenAI Batch API (half price, up to 24h turnaround)")
+    args = parser.parse_args()
+    
+    analyzer = EnhancedSegmentAnalyzer(refresh_cache=args.refresh_cache)
     sitemap_path = Path('video_final_data/web_full_site_map.json')
-    result = analyzer.analyze_visual_segments(sitemap_path)
+    if args.batch_api:
+        result = analyzer.analyze_visual_segments_batch(sitemap_path)
+    else:
+        result = analyzer.analyze_visual_segments(sitemap_path)
     
     print(f"\n=== Enhanced Segment Analysis Results ===")
     print(f"Total unique visual segments analyzed: {result['unique_segment_states']['total_unique_segments']}")
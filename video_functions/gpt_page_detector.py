@@ -5,16 +5,67 @@ Uses GPT to intelligently detect page transitions from natural language
 """
 
 import json
-import os
+import asyncio
+import orjson
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict
-from openai import OpenAI
-from dotenv import load_dotenv
+
+from openai import AsyncOpenAI
+
+from .openai_client import create_async_openai_client, create_completion_with_retry_async
+
+# Known pages whose URL is not just the slugified page name
+PAGE_URLS = {
+    'Calendar': '/calendar',
+    'My Activities': '/activities',
+    'Today': '/today',
+    'Search Workouts': '/workouts/search',
+    'My Workouts': '/workouts/my',
+    'Coach Jack Plan Builder': '/coach-jack',
+    'Training Plans': '/plans',
+    'My Plans': '/plans/my',
+    'Create Workout': '/workouts/create',
+    'Profile Settings': '/profile',
+    'Home': '/'
+}
+
+# Structured Outputs schema: the reply is always an object with a "pages" list
+PAGE_TRANSITIONS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "page_transitions",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "pages": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "sentence_id": {"type": "integer"},
+                            "page_name": {"type": "string"},
+                            "description": {"type": "string"}
+                        },
+                        "required": ["sentence_id", "page_name", "description"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["pages"],
+            "additionalProperties": False
+        }
+    }
+}
 
 class GPTPageDetector:
-    def __init__(self):
-        load_dotenv()
-        self.client = OpenAI()
+    def __init__(self, window_size: int = 300, window_overlap: int = 30, max_concurrent_requests: int = 8):
+        self.window_size = window_size  # Sentences sent to GPT per request
+        self.window_overlap = window_overlap  # Sentences shared by neighbouring windows
+        self.max_concurrent_requests = max_concurrent_requests
+        self.model = "gpt-4o-mini"  # Plain text classification; no need for a full-size model
+        self.duplicate_transition_distance = 5  # Same page detected this close in two windows is one transition
     
     def detect_pages_with_gpt(self, sentences_with_timestamps: List[Dict], output_dir: Path) -> List[Dict]:
         """
@@ -29,24 +80,26 @@ class GPTPageDetector:
         """
         print("Using GPT to detect page transitions...")
         
-        # Prepare the transcript for GPT
-        transcript_text = self._prepare_transcript_for_gpt(sentences_with_timestamps)
-        
-        # Get page transitions from GPT
-        page_transitions = self._get_page_transitions_from_gpt(transcript_text)
+        # Get page transitions from GPT, one overlapping window of the transcript per request
+        step = self.window_size - self.window_overlap
+        windows = [
+            sentences_with_timestamps[i:i + self.window_size]
+            for i in range(0, max(len(sentences_with_timestamps) - self.window_overlap, 1), step)
+        ]
+        window_transitions = asyncio.run(self._get_page_transitions_for_windows(windows))
+        page_transitions = self._merge_window_transitions(window_transitions)
         
         # Apply transitions to create page groupings
         pages = self._apply_transitions_to_sentences(page_transitions, sentences_with_timestamps)
         
-        # Save results (save to both GPT-specific and standard filenames)
+        # Save results (save to both GPT-specific and standard filenames), serializing once
+        pages_json = orjson.dumps(pages, option=orjson.OPT_INDENT_2)
         gpt_output_path = output_dir / "gpt_page_detection_results.json"
-        with open(gpt_output_path, 'w') as f:
-            json.dump(pages, f, indent=2)
+        gpt_output_path.write_bytes(pages_json)
         
         # Also save to the standard filename that other parts of the pipeline expect
-        standard_output_path = output_dir / "page_detection_results.json" 
-        with open(standard_output_path, 'w') as f:
-            json.dump(pages, f, indent=2)
+        standard_output_path = output_dir / "page_detection_results.json"
+        standard_output_path.write_bytes(pages_json)
         
         print(f"Detected {len(pages)} pages using GPT")
         for page in pages:
@@ -61,7 +114,47 @@ class GPTPageDetector:
             lines.append(f"[{sent['sentence_id']}] {sent['sentence']}")
         return "\n".join(lines)
     
-    def _get_page_transitions_from_gpt(self, transcript: str) -> List[Dict]:
+    async def _get_page_transitions_for_windows(self, windows: List[List[Dict]]) -> List[List[Dict]]:
+        """Detect transitions in every transcript window concurrently"""
+        if len(windows) > 1:
+            print(f"Splitting transcript into {len(windows)} windows of up to {self.window_size} sentences")
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        
+        async with create_async_openai_client() as client:
+            async def detect(window: List[Dict]) -> List[Dict]:
+                async with semaphore:
+                    transcript_text = self._prepare_transcript_for_gpt(window)
+                    return await self._get_page_transitions_from_gpt(client, transcript_text)
+            
+            return await asyncio.gather(*(detect(window) for window in windows))
+    
+    def _merge_window_transitions(self, window_transitions: List[List[Dict]]) -> List[Dict]:
+        """
+        Combine the transitions found in overlapping windows
+        
+        A window starting mid-page reports that page again at its first
+        sentence, and the overlap is seen twice, so drop transitions that
+        stay on the current page or repeat a nearby one.
+        """
+        transitions = sorted(
+            (transition for found in window_transitions for transition in found),
+            key=lambda x: x['sentence_id']
+        )
+        
+        merged = []
+        last_seen: Dict[str, int] = {}
+        for transition in transitions:
+            page_name = transition['page_name']
+            if merged and merged[-1]['page_name'] == page_name:
+                continue
+            if page_name in last_seen and transition['sentence_id'] - last_seen[page_name] <= self.duplicate_transition_distance:
+                continue
+            merged.append(transition)
+            last_seen[page_name] = transition['sentence_id']
+        
+        return merged
+    
+    async def _get_page_transitions_from_gpt(self, client: AsyncOpenAI, transcript: str) -> List[Dict]:
         """Ask GPT to identify page transitions"""
         
         prompt = """Analyze this video transcript where someone is demonstrating a web application's UI. 
@@ -80,43 +173,38 @@ Look for phrases like:
 - "The next page is [page]"
 - Any other natural language indicating a page change
 
-Return the results as a JSON array with this format:
-[
-  {
-    "sentence_id": 0,
-    "page_name": "Calendar",
-    "description": "Main calendar view for planning workouts"
-  },
-  ...
-]
-
 Transcript:
 """ + transcript
 
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
+            response = await create_completion_with_retry_async(
+                client,
+                model=self.model,
                 messages=[
-                    {"role": "system", "content": "You are an expert at analyzing UI walkthrough videos and identifying page transitions. Always respond with valid JSON."},
+                    {"role": "system", "content": (
+                        "You are an expert at analyzing UI walkthrough videos and identifying page transitions. "
+                        "Return the transitions as JSON under the key \"pages\", each with sentence_id, "
+                        "page_name and description, e.g. "
+                        "{\"pages\": [{\"sentence_id\": 0, \"page_name\": \"Calendar\", "
+                        "\"description\": \"Main calendar view for planning workouts\"}]}"
+                    )},
                     {"role": "user", "content": prompt}
                 ],
-                temperature=0.3
+                temperature=0.3,
+                response_format=PAGE_TRANSITIONS_RESPONSE_FORMAT
             )
-            
-            result = json.loads(response.choices[0].message.content)
-            
-            # Ensure we have an array
-            if isinstance(result, dict) and 'pages' in result:
-                return result['pages']
-            elif isinstance(result, list):
-                return result
-            else:
-                print("Unexpected GPT response format")
-                return []
-                
         except Exception as e:
             print(f"Error calling GPT: {e}")
             return []
+        
+        try:
+            result = json.loads(response.choices[0].message.content)
+        except (TypeError, json.JSONDecodeError) as e:
+            # Only a truncated or refused reply can fail the schema; not retried
+            print(f"GPT returned invalid JSON: {e}")
+            return []
+        
+        return result['pages']
     
     def _apply_transitions_to_sentences(self, transitions: List[Dict], sentences: List[Dict]) -> List[Dict]:
         """Apply the GPT-detected transitions to group sentences into pages"""
@@ -156,21 +244,8 @@ Transcript:
         
         return pages
     
-    def _generate_url_from_page_name(self, page_name: str) -> str:
-        """Generate a URL slug from the page name"""
-        # Simple URL generation - could be enhanced
-        url_map = {
-            'Calendar': '/calendar',
-            'My Activities': '/activities',
-            'Today': '/today',
-            'Search Workouts': '/workouts/search',
-            'My Workouts': '/workouts/my',
-            'Coach Jack Plan Builder': '/coach-jack',
-            'Training Plans': '/plans',
-            'My Plans': '/plans/my',
-            'Create Workout': '/workouts/create',
-            'Profile Settings': '/profile',
-            'Home': '/'
-        }
-        
-        return url_map.get(page_name, '/' + page_name.lower().replace(' ', '-'))
\ No newline at end of file
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _generate_url_from_page_name(page_name: str) -> str:
+        """Generate a URL slug from the page name (page names repeat, so cached)"""
+        return PAGE_URLS.get(page_name) or '/' + page_name.lower().replace(' ', '-')
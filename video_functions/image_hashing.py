@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Image Hashing Functions
+Perceptual hashes and SSIM for fast near-duplicate screenshot detection
+"""
+
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# 16x16 low-frequency DCT block -> 256-bit hash. The classic 8x8 (64-bit)
+# pHash cannot tell apart app pages that share the same layout shell.
+HASH_SIZE = 16
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+# Side of the grayscale thumbnail shared by hashing and SSIM (64 KB per image)
+THUMBNAIL_SIZE = 256
+
+# SSIM parameters (skimage defaults for uint8 images: 7x7 uniform window)
+SSIM_WINDOW = 7
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# Caches key files on (path, st_mtime_ns, st_size) so a screenshot rewritten
+# in place (e.g. by a rerun of the extractor) is never served stale
+FileKey = Tuple[str, Optional[int], Optional[int]]
+
+def _file_key(image_path: str) -> FileKey:
+    """Cache key for a file's current contents; unreadable files get no stat fields"""
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return (image_path, None, None)
+    return (image_path, stat.st_mtime_ns, stat.st_size)
+
+def load_thumbnail(image_path: str) -> Optional[np.ndarray]:
+    """
+    Decode an image once into a small grayscale thumbnail
+
+    Args:
+        image_path: Path to image file
+
+    Returns:
+        THUMBNAIL_SIZE x THUMBNAIL_SIZE uint8 array, or None if unreadable
+    """
+    return _load_thumbnail_cached(_file_key(image_path))
+
+@lru_cache(maxsize=1024)
+def _load_thumbnail_cached(key: FileKey) -> Optional[np.ndarray]:
+    """Decode one version of an image into its thumbnail"""
+    img = cv2.imread(key[0], cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    return cv2.resize(img, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA)
+
+# Hashes by file key; seeded in bulk by compute_phashes()
+_phash_cache: Dict[FileKey, Optional[int]] = {}
+_digest_cache: Dict[FileKey, Optional[str]] = {}
+
+def compute_file_digest(image_path: str) -> Optional[str]:
+    """
+    Compute a SHA-256 digest of an image file's bytes
+
+    Byte-identical screenshots (unchanged frames) share a digest, so they
+    can be matched without decoding the image at all.
+
+    Args:
+        image_path: Path to image file
+
+    Returns:
+        Hex digest, or None if the file could not be read
+    """
+    return _digest_for_key(_file_key(image_path))
+
+def _digest_for_key(key: FileKey) -> Optional[str]:
+    """SHA-256 of one version of a file, cached by its file key"""
+    if key not in _digest_cache:
+        try:
+            with open(key[0], 'rb') as f:
+                _digest_cache[key] = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            _digest_cache[key] = None
+    return _digest_cache[key]
+
+def _phash_from_file(image_path: str) -> Optional[int]:
+    """Hash one image; module-level so worker processes can pickle it"""
+    thumbnail = load_thumbnail(image_path)
+    if thumbnail is None:
+        return None
+
+    side = HASH_SIZE * 4
+    small = cv2.resize(thumbnail, (side, side), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:HASH_SIZE, :HASH_SIZE].flatten()
+
+    # Binarize against the median of the AC terms (DC only reflects brightness)
+    bits = low_freq > np.median(low_freq[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def compute_phash(image_path: str) -> Optional[int]:
+    """
+    Compute a DCT perceptual hash of an image
+
+    Args:
+        image_path: Path to image file
+
+    Returns:
+        HASH_BITS-bit hash as an int, or None if the image could not be read
+    """
+    key = _file_key(image_path)
+    if key not in _phash_cache:
+        _phash_cache[key] = _phash_from_file(image_path)
+    return _phash_cache[key]
+
+def compute_phashes(image_paths: List[str], min_parallel: int = 32) -> Dict[str, Optional[int]]:
+    """
+    Hash many images up front, in worker processes when there are enough of them
+
+    Args:
+        image_paths: Paths to image files
+        min_parallel: Below this many uncached images, hash in-process
+
+    Returns:
+        Dictionary of path -> hash (None for unreadable images)
+    """
+    keys = {path: _file_key(path) for path in image_paths}
+    missing = [key for key in dict.fromkeys(keys.values()) if key not in _phash_cache]
+
+    # Decode only one file per distinct content; byte-identical copies share its hash
+    copies: Dict[FileKey, List[FileKey]] = {}
+    first_by_digest: Dict[str, FileKey] = {}
+    for key in missing:
+        digest = _digest_for_key(key)
+        if digest is not None and digest in first_by_digest:
+            copies[first_by_digest[digest]].append(key)
+            continue
+        if digest is not None:
+            first_by_digest[digest] = key
+        copies[key] = []
+    distinct = list(copies)
+
+    if len(distinct) >= min_parallel:
+        with ProcessPoolExecutor() as executor:
+            hashes = executor.map(_phash_from_file, [key[0] for key in distinct], chunksize=16)
+            _phash_cache.update(zip(distinct, hashes))
+    else:
+        for key in distinct:
+            _phash_cache[key] = _phash_from_file(key[0])
+
+    for key, duplicate_keys in copies.items():
+        for duplicate_key in duplicate_keys:
+            _phash_cache[duplicate_key] = _phash_cache[key]
+
+    return {path: _phash_cache[key] for path, key in keys.items()}
+
+def structural_similarity(image1: np.ndarray, image2: np.ndarray) -> float:
+    """
+    Mean SSIM of two equally sized grayscale images
+
+    Same result as skimage.metrics.structural_similarity with its defaults,
+    but the local means and moments come from cv2.boxFilter in place of
+    skimage's chain of scipy filters and temporary arrays.
+
+    Args:
+        image1: uint8 grayscale image
+        image2: uint8 grayscale image of the same shape
+
+    Returns:
+        Mean structural similarity in [-1, 1]
+    """
+    a = image1.astype(np.float64)
+    b = image2.astype(np.float64)
+
+    def local_mean(x: np.ndarray) -> np.ndarray:
+        return cv2.boxFilter(x, -1, (SSIM_WINDOW, SSIM_WINDOW), borderType=cv2.BORDER_REFLECT)
+
+    # Sample (not population) covariance, as skimage does
+    window_pixels = SSIM_WINDOW * SSIM_WINDOW
+    cov_norm = window_pixels / (window_pixels - 1)
+
+    mu_a = local_mean(a)
+    mu_b = local_mean(b)
+    mu_ab = mu_a * mu_b
+    mu_a *= mu_a
+    mu_b *= mu_b
+    var_sum = cov_norm * (local_mean(a * a) + local_mean(b * b) - mu_a - mu_b)
+    covariance = cov_norm * (local_mean(a * b) - mu_ab)
+
+    numerator = (2 * mu_ab + SSIM_C1) * (2 * covariance + SSIM_C2)
+    denominator = (mu_a + mu_b + SSIM_C1) * (var_sum + SSIM_C2)
+
+    # Ignore the border where the window hangs over the image edge
+    pad = (SSIM_WINDOW - 1) // 2
+    return float((numerator / denominator)[pad:-pad, pad:-pad].mean())
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    """Number of differing bits between two perceptual hashes"""
+    return bin(hash1 ^ hash2).count('1')
+
+class BKTree:
+    """Burkhard-Keller tree over perceptual hashes, keyed by Hamming distance"""
+
+    def __init__(self):
+        self.root = None  # (hash, value, {distance: child_node})
+
+    def add(self, hash_value: int, value: Any):
+        """Insert a hash with an associated value"""
+        node = (hash_value, value, {})
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = hamming_distance(hash_value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def find(self, hash_value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """Return (distance, value) pairs within max_distance, closest first"""
+        results = []
+        pending = [self.root] if self.root is not None else []
+
+        while pending:
+            node_hash, value, children = pending.pop()
+            distance = hamming_distance(hash_value, node_hash)
+            if distance <= max_distance:
+                results.append((distance, value))
+
+            # Triangle inequality: only subtrees in this band can hold matches
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    pending.append(child)
+
+        results.sort(key=lambda result: result[0])
+        return results
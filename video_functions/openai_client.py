@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+OpenAI Client Functions
+Shared OpenAI clients with pooled (and, when available, HTTP/2) connections
+"""
+
+import asyncio
+import os
+import random
+from functools import lru_cache
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import APIConnectionError, AsyncOpenAI, InternalServerError, OpenAI, RateLimitError
+
+from .rate_limiter import RateLimiter
+
+try:
+    import h2  # noqa: F401  (httpx[http2] extra)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Keep-alive pool shared by every request a client makes; sized above the
+# analyzers' default concurrency so requests never queue for a connection
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+
+# Fail fast on connect, but leave room for multi-image Vision replies
+HTTP_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+# Large uploads (Whisper audio chunks, Batch API input files) keep the SDK's
+# 600s default; pass it per call as timeout=UPLOAD_TIMEOUT
+UPLOAD_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+
+# Transient failures worth retrying (APITimeoutError is an APIConnectionError)
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+MAX_RETRY_ATTEMPTS = 5
+
+# Clients are built with the SDK's own retries off, so create_completion_with_retry_async
+# is the only retry layer and every 429 reaches its rate limiter. Calls that do not go
+# through it opt back in with client.with_options(max_retries=SDK_MAX_RETRIES).
+SDK_MAX_RETRIES = 2
+
+@lru_cache(maxsize=None)
+def _load_environment():
+    """Read .env once, on first client creation, unless the key is already set"""
+    if not os.getenv('OPENAI_API_KEY'):
+        load_dotenv()
+
+@lru_cache(maxsize=None)
+def get_openai_client() -> OpenAI:
+    """
+    Get the process-wide synchronous OpenAI client
+
+    Returns:
+        OpenAI client whose connection pool is reused by every caller (SDK retries off)
+    """
+    _load_environment()
+    return OpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        max_retries=0,
+        http_client=httpx.Client(http2=HTTP2_AVAILABLE, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    )
+
+def create_async_openai_client() -> AsyncOpenAI:
+    """
+    Create an AsyncOpenAI client for the current event loop
+
+    httpx async pools are bound to the loop they were opened on, so use one
+    client per asyncio.run() (as an async context manager) rather than a
+    process-wide singleton.
+
+    Returns:
+        AsyncOpenAI client with a pooled connection limit (SDK retries off)
+    """
+    _load_environment()
+    return AsyncOpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        max_retries=0,
+        http_client=httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    )
+
+def _should_retry(error: Exception) -> bool:
+    """Transient API failure? An exhausted billing quota is also a 429 but will not recover"""
+    if not isinstance(error, RETRYABLE_ERRORS):
+        return False
+    return not (isinstance(error, RateLimitError) and 'quota' in str(error).lower())
+
+def _backoff_delay(attempt: int) -> float:
+    """Random exponential backoff between 1s and 60s; the upper bound doubles per attempt"""
+    return random.uniform(1, min(60, 2 ** (attempt + 1)))
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds a 429 response asked us to wait (its Retry-After header), if it said"""
+    if not isinstance(error, RateLimitError):
+        return None
+    try:
+        return float(error.response.headers['retry-after'])
+    except (KeyError, ValueError):
+        return None
+
+async def create_completion_with_retry_async(
+    client: AsyncOpenAI,
+    max_attempts: int = MAX_RETRY_ATTEMPTS,
+    rate_limiter: Optional[RateLimiter] = None,
+    estimated_tokens: int = 0,
+    **request
+):
+    """
+    Create a chat completion, retrying rate limits, timeouts and 5xx errors
+
+    When a rate_limiter is given, every attempt first waits for budget for
+    estimated_tokens, so requests are paced instead of bouncing off 429s.
+    A 429 that still gets through pauses the limiter for its Retry-After
+    (or the backoff delay), so every in-flight caller backs off, not just this one.
+
+    Args:
+        client: AsyncOpenAI client
+        max_attempts: Attempts before the last error is raised
+        rate_limiter: Shared request/token budget to wait on, if any
+        estimated_tokens: Tokens this request counts against the rate_limiter
+        **request: Arguments for client.chat.completions.create
+
+    Returns:
+        Chat completion response
+    """
+    for attempt in range(max_attempts):
+        try:
+            if rate_limiter is not None:
+                await rate_limiter.acquire(estimated_tokens)
+            return await client.chat.completions.create(**request)
+        except Exception as e:
+            if attempt == max_attempts - 1 or not _should_retry(e):
+                raise
+            retry_after = _retry_after(e)
+            delay = retry_after if retry_after is not None else _backoff_delay(attempt)
+
+            if rate_limiter is not None and isinstance(e, RateLimitError):
+                print(f"  Rate limited, pausing requests for {delay:.1f}s")
+                rate_limiter.pause(delay)  # The next acquire() waits it out
+                continue
+
+            print(f"  OpenAI request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
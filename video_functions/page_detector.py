@@ -4,8 +4,8 @@ Page Detection Functions
 Detect page transitions and organize sentences by page
 """
 
-import json
 import re
+import orjson
 from pathlib import Path
 from typing import List, Dict
 
@@ -21,6 +21,18 @@ class PageDetector:
             (r"green screen", "transition")
         ]
         
+        # Compile once; the detection loop runs every pattern over every sentence
+        self._compiled_patterns = [(re.compile(pattern), replacement) for pattern, replacement in self.page_patterns]
+        self._transition_patterns = {
+            compiled for compiled, replacement in self._compiled_patterns if replacement == "transition"
+        }
+        
+        # Every pattern starts with a literal phrase; one scan for any of them
+        # rules out the many sentences that mention no page at all
+        self._anchor_pattern = re.compile("|".join(
+            re.escape(pattern.split("(", 1)[0].strip()) for pattern, _ in self.page_patterns
+        ))
+        
         self.page_mappings = {
             "calendar": "Training Calendar",
             "my activities": "My Activities", 
@@ -39,6 +51,13 @@ class PageDetector:
             "profile": "Profile Settings",
             "settings": "Profile Settings"
         }
+        
+        # Known page keywords as one whole-word alternation, longest first so
+        # "my workouts" wins over "workouts" at the same position
+        self._page_keyword_pattern = re.compile(r"\b(?:" + "|".join(
+            re.escape(keyword) for keyword in sorted(self.page_mappings, key=len, reverse=True)
+        ) + r")\b")
+        self._normalized_page_names: Dict[str, str] = {}
     
     def detect_pages_from_sentences(self, sentences_with_screenshots: List[Dict], output_dir: Path) -> List[Dict]:
         """
@@ -67,10 +86,14 @@ class PageDetector:
             
             # Check for page name patterns
             page_found = False
-            for pattern, replacement in self.page_patterns:
-                match = re.search(pattern, sentence_text)
+            if not self._anchor_pattern.search(sentence_text):
+                current_page["sentences"].append(sentence_data)
+                continue
+            
+            for pattern, replacement in self._compiled_patterns:
+                match = pattern.search(sentence_text)
                 if match:
-                    if pattern in ["transition to the next page", "green screen"]:
+                    if pattern in self._transition_patterns:
                         # Mark as transition but don't change page yet
                         sentence_data['is_transition'] = True
                         continue
@@ -81,7 +104,7 @@ class PageDetector:
                     # Start new page if we found a different one
                     if normalized_page_name != current_page["page_name"] and current_page["sentences"]:
                         current_page["end_sentence"] = sentence_data['sentence_id'] - 1
-                        pages.append(current_page.copy())
+                        pages.append(current_page)
                         current_page = {
                             "page_name": normalized_page_name,
                             "start_sentence": sentence_data['sentence_id'],
@@ -109,17 +132,29 @@ class PageDetector:
         
         # Save page detection results
         output_path = output_dir / "page_detection_results.json"
-        with open(output_path, 'w') as f:
-            json.dump(pages, f, indent=2)
+        output_path.write_bytes(orjson.dumps(pages, option=orjson.OPT_INDENT_2))
         
         print(f"Saved page detection results to: {output_path}")
         
         return pages
     
     def _normalize_page_name(self, page_name: str) -> str:
-        """Normalize page names to standard format"""
+        """Normalize page names to standard format (captures repeat, so cached)"""
+        if page_name not in self._normalized_page_names:
+            self._normalized_page_names[page_name] = self._lookup_page_name(page_name)
+        return self._normalized_page_names[page_name]
+    
+    def _lookup_page_name(self, page_name: str) -> str:
+        """Map a captured page name to its canonical name"""
         normalized = page_name.lower().strip()
-        return self.page_mappings.get(normalized, page_name.title())
+        if normalized in self.page_mappings:
+            return self.page_mappings[normalized]
+        
+        # Captures often carry extra words ("the calendar", "coach jack builder")
+        keyword_match = self._page_keyword_pattern.search(normalized)
+        if keyword_match:
+            return self.page_mappings[keyword_match.group(0)]
+        return page_name.title()
     
     def extract_common_elements(self, pages: List[Dict]) -> Dict:
         """
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Rate Limiting Functions
+Proactive request/token throttling for concurrent OpenAI API calls
+"""
+
+import asyncio
+import time
+
+# Approximate image input tokens for a 16:9 screenshot sent to GPT-4o
+IMAGE_TOKENS = {
+    'low': 85,
+    'high': 1105  # 85 base + 6 tiles x 170
+}
+
+def estimate_request_tokens(prompt: str, max_tokens: int, images: int = 1, detail: str = 'high') -> int:
+    """
+    Estimate the tokens a Vision request counts against the TPM limit
+
+    Args:
+        prompt: Text part of the request
+        max_tokens: Completion token cap of the request
+        images: Number of images attached
+        detail: Image detail level ('low' or 'high')
+
+    Returns:
+        Estimated total tokens (prompt + images + completion)
+    """
+    return len(prompt) // 4 + images * IMAGE_TOKENS[detail] + max_tokens
+
+class RateLimiter:
+    """
+    Leaky-bucket budget for requests and tokens per minute, following the
+    openai-cookbook api_request_parallel_processor pattern. Callers wait
+    until both budgets cover the next request instead of hitting 429s.
+    """
+
+    def __init__(self, max_requests_per_minute: float, max_tokens_per_minute: float):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.available_request_capacity = max_requests_per_minute
+        self.available_token_capacity = max_tokens_per_minute
+        self.last_update_time = time.monotonic()
+        self.paused_until = 0.0
+
+    def _replenish(self):
+        """Refill both budgets for the time elapsed since the last update"""
+        now = time.monotonic()
+        elapsed = now - self.last_update_time
+        self.available_request_capacity = min(
+            self.max_requests_per_minute,
+            self.available_request_capacity + elapsed * self.max_requests_per_minute / 60.0
+        )
+        self.available_token_capacity = min(
+            self.max_tokens_per_minute,
+            self.available_token_capacity + elapsed * self.max_tokens_per_minute / 60.0
+        )
+        self.last_update_time = now
+
+    async def acquire(self, estimated_tokens: int):
+        """Wait until there is budget for one request of estimated_tokens, then spend it"""
+        # A request larger than the whole budget would otherwise wait forever
+        estimated_tokens = min(estimated_tokens, self.max_tokens_per_minute)
+
+        while True:
+            self._replenish()
+            wait = self.paused_until - time.monotonic()
+
+            if wait <= 0:
+                if (self.available_request_capacity >= 1 and
+                        self.available_token_capacity >= estimated_tokens):
+                    self.available_request_capacity -= 1
+                    self.available_token_capacity -= estimated_tokens
+                    return
+
+                request_shortfall = max(0.0, 1 - self.available_request_capacity)
+                token_shortfall = max(0.0, estimated_tokens - self.available_token_capacity)
+                wait = max(
+                    request_shortfall * 60.0 / self.max_requests_per_minute,
+                    token_shortfall * 60.0 / self.max_tokens_per_minute
+                )
+
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hold back all callers, e.g. for the Retry-After of a 429 response"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
@@ -1,25 +1,70 @@
 #!/usr/bin/env python3
 """
-Screenshot Deduplicator - Fast hash-based duplicate removal
+Screenshot Deduplicator - Fast hash-based duplicate removal, plus perceptual
+hashing for near-identical frames
 """
 
+import os
 import json
+import orjson
 import hashlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Set
+from typing import Dict, Iterator, List, Optional, Set
 
-class ScreenshotDeduplicator:
-    def __init__(self):
+from .image_hashing import BKTree, compute_phashes
+
+# Read size for hashing on Pythons without hashlib.file_digest (< 3.11)
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# Concurrent unlinks; per-file latency dominates on network and NTFS mounts
+DELETE_WORKERS = 16
+
+def _remove_file(file_path: Path):
+    """Delete a file, ignoring one that is already gone"""
+    try:
+        os.unlink(file_path)
+    except FileNotFoundError:
         pass
+
+class ScreenshotDeduplicator:
+    def __init__(self, phash_threshold: Optional[int] = 8, verbose: bool = False):
+        # Max Hamming distance (of 256 bits) for two frames to count as the same
+        # screenshot. Tighter than AIAnalyzer's 16 since matches get deleted;
+        # None disables near-duplicate detection
+        self.phash_threshold = phash_threshold
+        self.verbose = verbose  # Also list the verdict for every screenshot
     
     def get_file_hash(self, file_path: Path) -> str:
         """Get MD5 hash of file for fast duplicate detection"""
-        hash_md5 = hashlib.md5()
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+            if hasattr(hashlib, 'file_digest'):
+                return hashlib.file_digest(f, 'md5').hexdigest()
+            
+            hash_md5 = hashlib.md5()
+            buffer = bytearray(HASH_BUFFER_SIZE)
+            view = memoryview(buffer)
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                hash_md5.update(view[:read])
+            return hash_md5.hexdigest()
 
+    def _iter_sentences(self, pages: List[Dict]) -> Iterator[Dict]:
+        """Yield every sentence (visual segment) of every page"""
+        for page in pages:
+            sentences = page.get('visual_segments')
+            if sentences is None:
+                sentences = page.get('sentences', ())
+            yield from sentences
+    
+    def _delete_files(self, file_paths: List[Path]):
+        """Delete files concurrently (unlink releases the GIL)"""
+        with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+            list(executor.map(_remove_file, file_paths))
+    
     def deduplicate_screenshots(self, sitemap_path: Path) -> Dict:
         """Fast hash-based deduplication of screenshots"""
         
@@ -30,16 +75,18 @@ class ScreenshotDeduplicator:
         
         print("=== Fast Screenshot Deduplication ===")
         
-        # Get referenced files
+        # Get referenced files, and each referenced file once in sitemap order
+        # with every reference to it
         referenced_files = set()
-        for page in sitemap.get('pages', []):
-            for sentence in page.get('visual_segments', page.get('sentences', [])):
-                if sentence.get('screenshot'):
-                    screenshot = sentence['screenshot']
-                    if screenshot.startswith('screenshots_web_full/'):
-                        referenced_files.add(screenshot.replace('screenshots_web_full/', ''))
-                    else:
-                        referenced_files.add(screenshot)
+        file_references: Dict[Path, List[str]] = {}
+        for sentence in self._iter_sentences(sitemap.get('pages', [])):
+            screenshot = sentence.get('screenshot')
+            if screenshot:
+                filename = screenshot.removeprefix('screenshots_web_full/')
+                referenced_files.add(filename)
+                references = file_references.setdefault(screenshots_dir / filename, [])
+                if screenshot not in references:
+                    references.append(screenshot)
         
         all_files = list(screenshots_dir.glob('*.jpg'))
         unreferenced_files = [f for f in all_files if f.name not in referenced_files]
@@ -49,68 +96,98 @@ class ScreenshotDeduplicator:
         print(f"Unreferenced: {len(unreferenced_files)}")
         
         # Delete unreferenced files
-        for file_path in unreferenced_files:
-            file_path.unlink()
+        self._delete_files(unreferenced_files)
         
         print(f"Deleted {len(unreferenced_files)} unreferenced files")
         
         # Fast hash-based deduplication of referenced files
         print("\\n=== Hash-based deduplication ===")
+        file_paths = [file_path for file_path in file_references if file_path.exists()]
+        
+        # Only files of equal size can be byte-identical, so a file with a
+        # size of its own is unique without reading it
+        file_sizes = [file_path.stat().st_size for file_path in file_paths]
+        size_counts = Counter(file_sizes)
+        to_hash = [
+            file_path for file_path, size in zip(file_paths, file_sizes)
+            if size_counts[size] > 1
+        ]
+        print(f"Hashing {len(to_hash)} of {len(file_paths)} files (the rest have unique sizes)")
+        
+        # Hash files concurrently; hashlib releases the GIL while digesting
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            hashes_by_path = dict(zip(to_hash, executor.map(self.get_file_hash, to_hash)))
+        file_hashes = [
+            (size, hashes_by_path.get(file_path))
+            for file_path, size in zip(file_paths, file_sizes)
+        ]
+        
+        # Frames a few pixels apart hash differently; catch them by pHash distance
+        phashes = {}
+        if self.phash_threshold is not None:
+            phashes = compute_phashes([str(file_path) for file_path in file_paths])
+        
         hash_to_file = {}
+        near_duplicates = BKTree()
         duplicates = []
         representatives = {}
-        
-        for page in sitemap.get('pages', []):
-            for sentence in page.get('visual_segments', page.get('sentences', [])):
-                if sentence.get('screenshot'):
-                    screenshot = sentence['screenshot']
-                    if screenshot.startswith('screenshots_web_full/'):
-                        filename = screenshot.replace('screenshots_web_full/', '')
-                    else:
-                        filename = screenshot
-                    
-                    file_path = screenshots_dir / filename
-                    if file_path.exists():
-                        file_hash = self.get_file_hash(file_path)
-                        
-                        if file_hash in hash_to_file:
-                            # Duplicate found
-                            representative = hash_to_file[file_hash]
-                            representatives[screenshot] = representative
-                            if file_path not in duplicates:
-                                duplicates.append(file_path)
-                            print(f"  {screenshot}: DUPLICATE of {representative}")
-                        else:
-                            # First occurrence
-                            hash_to_file[file_hash] = screenshot
-                            representatives[screenshot] = screenshot
-                            print(f"  {screenshot}: UNIQUE")
+        verdicts = Counter()
+        verdict_lines = []
+        
+        for file_path, file_hash in zip(file_paths, file_hashes):
+            representative = hash_to_file.get(file_hash)
+            label = "DUPLICATE"
+            phash = phashes.get(str(file_path))
+            if representative is None and phash is not None:
+                matches = near_duplicates.find(phash, self.phash_threshold)
+                if matches:
+                    representative = matches[0][1]
+                    label = "NEAR-DUPLICATE"
+            
+            for screenshot in file_references[file_path]:
+                if representative is not None:
+                    # Duplicate found
+                    representatives[screenshot] = representative
+                    verdicts[label] += 1
+                    verdict_lines.append(f"  {screenshot}: {label} of {representative}")
+                else:
+                    # First occurrence
+                    representatives[screenshot] = screenshot
+                    verdicts["UNIQUE"] += 1
+                    verdict_lines.append(f"  {screenshot}: UNIQUE")
+            
+            if representative is not None:
+                duplicates.append(file_path)
+            else:
+                hash_to_file[file_hash] = file_references[file_path][0]
+                if phash is not None:
+                    near_duplicates.add(phash, file_references[file_path][0])
         
         # Delete duplicate files
-        for file_path in duplicates:
-            file_path.unlink()
+        self._delete_files(duplicates)
+        
+        # One write for the whole listing instead of a print per screenshot
+        if self.verbose and verdict_lines:
+            print("\n".join(verdict_lines))
+        print(", ".join(f"{count} {label}" for label, count in verdicts.items()) or "No referenced screenshots")
         
         print(f"\\nDeleted {len(duplicates)} duplicate files")
         
         # Update sitemap references
         updated_count = 0
-        for page in sitemap.get('pages', []):
-            for sentence in page.get('visual_segments', page.get('sentences', [])):
-                if sentence.get('screenshot') and sentence['screenshot'] in representatives:
-                    old = sentence['screenshot']
-                    new = representatives[old]
-                    if old != new:
-                        sentence['screenshot'] = new
-                        updated_count += 1
+        for sentence in self._iter_sentences(sitemap.get('pages', [])):
+            if sentence.get('screenshot') and sentence['screenshot'] in representatives:
+                old = sentence['screenshot']
+                new = representatives[old]
+                if old != new:
+                    sentence['screenshot'] = new
+                    updated_count += 1
         
         # Save updated sitemap
         backup_path = sitemap_path.with_suffix('.backup.json')
-        if backup_path.exists():
-            backup_path.unlink()  # Remove old backup
-        sitemap_path.rename(backup_path)
+        sitemap_path.replace(backup_path)  # Overwrites any old backup
         
-        with open(sitemap_path, 'w') as f:
-            json.dump(sitemap, f, indent=2)
+        sitemap_path.write_bytes(orjson.dumps(sitemap, option=orjson.OPT_INDENT_2))
         
         # Final count
         final_files = len(list(screenshots_dir.glob('*.jpg')))
@@ -4,14 +4,31 @@ Screenshot Extraction Functions
 Extract screenshots from video at specific timestamps
 """
 
-import json
+import os
+import orjson
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from typing import List, Dict
-from moviepy.video.io.VideoFileClip import VideoFileClip
+
+import cv2
+
+def _save_jpeg(frame, screenshot_path: Path):
+    """
+    Encode a BGR frame to a JPEG file
+    
+    OpenCV encodes with its bundled libjpeg-turbo straight from the decoder's
+    BGR buffer (no RGB conversion or PIL copy) and releases the GIL meanwhile.
+    """
+    if not cv2.imwrite(str(screenshot_path), frame, [cv2.IMWRITE_JPEG_QUALITY, 85]):
+        raise IOError(f"Could not write {screenshot_path}")
 
 class ScreenshotExtractor:
-    def __init__(self):
-        pass
+    def __init__(self, max_decode_gap: float = 10.0):
+        # Seconds ahead of the last decoded frame beyond which a target is
+        # reached by seeking (keyframe + short decode) rather than decoding through
+        self.max_decode_gap = max_decode_gap
+        self.encode_workers = os.cpu_count() or 1
     
     def extract_screenshots_from_sentences(
         self, 
@@ -37,15 +54,34 @@ class ScreenshotExtractor:
         print(f"Video: {video_path}")
         print(f"Output: {screenshots_dir}")
         
-        # Load video
-        video = VideoFileClip(str(video_path))
-        video_duration = video.duration
+        # Open video; frames are decoded in one forward pass over the targets
+        video = cv2.VideoCapture(str(video_path))
+        if not video.isOpened():
+            raise IOError(f"Could not open video: {video_path}")
+        video_duration = self._video_duration(video)
+        if video_duration <= 0:
+            video.release()
+            raise IOError(f"Could not determine duration of video: {video_path}")
         
         print(f"Video duration: {video_duration/60:.1f} minutes")
         
-        enhanced_sentences = []
-        
-        for i, sentence_data in enumerate(sentences_with_timestamps):
+        # Visit sentences in time order; results go back in sentence order
+        order = sorted(
+            range(len(sentences_with_timestamps)),
+            key=lambda i: sentences_with_timestamps[i]['mid_timestamp']
+        )
+        enhanced_by_index = {}
+        frame = None
+        frame_time = float('-inf')
+        
+        # JPEG encoding runs on worker threads while the next frame decodes;
+        # in-flight saves are capped so decoded frames cannot pile up in memory
+        encoder = ThreadPoolExecutor(max_workers=self.encode_workers)
+        pending_saves = {}
+        in_flight = deque()
+        
+        for done, i in enumerate(order, 1):
+            sentence_data = sentences_with_timestamps[i]
             sentence_id = sentence_data['sentence_id']
             mid_timestamp = sentence_data['mid_timestamp']
             
@@ -57,46 +93,76 @@ class ScreenshotExtractor:
             screenshot_path = screenshots_dir / screenshot_filename
             
             try:
-                # Extract frame at timestamp
-                frame = video.get_frame(screenshot_time)
+                # Extract the first frame at or after the timestamp
+                if frame is None or frame_time < screenshot_time:
+                    if screenshot_time - frame_time > self.max_decode_gap:
+                        # Far ahead: seek near it instead of decoding every frame in between
+                        video.set(cv2.CAP_PROP_POS_MSEC, screenshot_time * 1000)
+                    while True:
+                        if not video.grab():
+                            raise IOError(f"No frame at {screenshot_time:.1f}s")
+                        frame_time = video.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                        if frame_time >= screenshot_time:
+                            break
+                    frame = video.retrieve()[1]
                 
                 # Save frame as image
-                from PIL import Image
-                img = Image.fromarray(frame.astype('uint8'))
-                img.save(screenshot_path, 'JPEG', quality=85)
+                save = encoder.submit(_save_jpeg, frame, screenshot_path)
+                pending_saves[i] = save
+                in_flight.append(save)
+                if len(in_flight) > 2 * self.encode_workers:
+                    wait([in_flight.popleft()])
                 
                 # Add screenshot info to sentence data
-                enhanced_sentence = sentence_data.copy()
-                enhanced_sentence['screenshot'] = f"screenshots/{screenshot_filename}"
-                enhanced_sentence['screenshot_timestamp'] = screenshot_time
+                enhanced_by_index[i] = {
+                    **sentence_data,
+                    'screenshot': f"screenshots/{screenshot_filename}",
+                    'screenshot_timestamp': screenshot_time
+                }
                 
-                enhanced_sentences.append(enhanced_sentence)
-                
-                if (i + 1) % 10 == 0:
-                    print(f"  Progress: {i + 1}/{len(sentences_with_timestamps)} screenshots")
+                if done % 10 == 0:
+                    print(f"  Progress: {done}/{len(sentences_with_timestamps)} screenshots")
                 
             except Exception as e:
                 print(f"  Error extracting screenshot for sentence {sentence_id}: {e}")
                 # Add sentence without screenshot
-                enhanced_sentence = sentence_data.copy()
-                enhanced_sentence['screenshot'] = None
-                enhanced_sentence['screenshot_timestamp'] = screenshot_time
-                enhanced_sentences.append(enhanced_sentence)
+                enhanced_by_index[i] = {**sentence_data, 'screenshot': None, 'screenshot_timestamp': screenshot_time}
+                # Decoder position is unknown after a failure; seek for the next target
+                frame = None
+                frame_time = float('-inf')
+        
+        video.release()
+        encoder.shutdown(wait=True)
         
-        video.close()
+        for i, save in pending_saves.items():
+            if save.exception() is not None:
+                print(f"  Error saving screenshot for sentence {sentences_with_timestamps[i]['sentence_id']}: {save.exception()}")
+                enhanced_by_index[i]['screenshot'] = None
+        
+        enhanced_sentences = [enhanced_by_index[i] for i in range(len(sentences_with_timestamps))]
         
         print(f"✅ Screenshot extraction complete!")
         print(f"Extracted {len([s for s in enhanced_sentences if s.get('screenshot')])} screenshots")
         
         # Save enhanced sentences with screenshots
         output_path = output_dir / "sentences_with_screenshots.json"
-        with open(output_path, 'w') as f:
-            json.dump(enhanced_sentences, f, indent=2)
+        output_path.write_bytes(orjson.dumps(enhanced_sentences, option=orjson.OPT_INDENT_2))
         
         print(f"Saved enhanced sentences to: {output_path}")
         
         return enhanced_sentences
     
+    def _video_duration(self, video: cv2.VideoCapture) -> float:
+        """Video length in seconds; containers without a frame rate are measured by seeking to the end"""
+        fps = video.get(cv2.CAP_PROP_FPS)
+        if fps > 0:
+            return video.get(cv2.CAP_PROP_FRAME_COUNT) / fps
+        
+        video.set(cv2.CAP_PROP_POS_AVI_RATIO, 1)
+        duration = video.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        video.set(cv2.CAP_PROP_POS_AVI_RATIO, 0)
+        return duration
+    
     def validate_screenshots(self, sentences_with_screenshots: List[Dict], output_dir: Path) -> Dict:
         """
         Validate screenshot extraction results
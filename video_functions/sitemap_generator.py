@@ -4,10 +4,14 @@ Sitemap Generation Functions
 Generate final sitemap structure with all enhancements
 """
 
-import json
+import orjson
+from collections import Counter
 from pathlib import Path
 from typing import List, Dict
 
+# Shared read-only default for sentences without an AI analysis
+_EMPTY_ANALYSIS: Dict = {}
+
 class SitemapGenerator:
     def __init__(self):
         pass
@@ -61,15 +65,14 @@ class SitemapGenerator:
         else:
             final_sitemap_path = output_dir / "final_sitemap.json"
         
-        # Save final sitemap
+        # Save final sitemap (serialized once for both locations)
+        sitemap_json = orjson.dumps(final_sitemap, option=orjson.OPT_INDENT_2)
         sitemap_path = output_dir / "final_sitemap.json"
-        with open(sitemap_path, 'w') as f:
-            json.dump(final_sitemap, f, indent=2)
+        sitemap_path.write_bytes(sitemap_json)
         
         # Also save to final location with proper naming
         if final_output_dir:
-            with open(final_sitemap_path, 'w') as f:
-                json.dump(final_sitemap, f, indent=2)
+            final_sitemap_path.write_bytes(sitemap_json)
             print(f"✅ Final sitemap generated!")
             print(f"Saved to: {final_sitemap_path}")
         else:
@@ -81,8 +84,7 @@ class SitemapGenerator:
         
         # Save statistics
         stats_path = output_dir / "sitemap_statistics.json"
-        with open(stats_path, 'w') as f:
-            json.dump(stats, f, indent=2)
+        stats_path.write_bytes(orjson.dumps(stats, option=orjson.OPT_INDENT_2))
         
         print(f"Statistics saved to: {stats_path}")
         
@@ -96,19 +98,32 @@ class SitemapGenerator:
         total_pages = len(pages)
         total_sentences = sum(page.get('total_sentences', 0) for page in pages)
         
-        # Page statistics
+        # Page statistics, overall totals and UI element / user action tallies in one pass
         page_stats = []
+        total_screenshots = 0
+        total_ai_analyses = 0
+        ui_elements = Counter()
+        user_actions = Counter()
+        
         for page in pages:
             sentences = page.get('sentences', [])
+            successful_analyses = 0
+            screenshots = 0
             
-            # Count successful AI analyses
-            successful_analyses = sum(
-                1 for s in sentences 
-                if s.get('ai_analysis', {}).get('comprehensive_page_description') != "Analysis unavailable"
-            )
-            
-            # Count screenshots
-            screenshots = sum(1 for s in sentences if s.get('screenshot'))
+            for sentence in sentences:
+                analysis = sentence.get('ai_analysis') or _EMPTY_ANALYSIS
+                
+                # Count successful AI analyses
+                if analysis.get('comprehensive_page_description') != "Analysis unavailable":
+                    successful_analyses += 1
+                
+                # Count screenshots
+                if sentence.get('screenshot'):
+                    screenshots += 1
+                
+                # Count UI elements and user actions
+                ui_elements.update(analysis.get('ui_elements_detected', ()))
+                user_actions.update(analysis.get('possible_user_actions', ()))
             
             page_stats.append({
                 "page_name": page.get('page_name'),
@@ -117,26 +132,8 @@ class SitemapGenerator:
                 "successful_ai_analyses": successful_analyses,
                 "relative_url": page.get('relative_url', 'unknown')
             })
-        
-        # Overall statistics
-        total_screenshots = sum(stat['screenshot_count'] for stat in page_stats)
-        total_ai_analyses = sum(stat['successful_ai_analyses'] for stat in page_stats)
-        
-        # UI elements analysis
-        ui_elements = {}
-        user_actions = {}
-        
-        for page in pages:
-            for sentence in page.get('sentences', []):
-                analysis = sentence.get('ai_analysis', {})
-                
-                # Count UI elements
-                for element in analysis.get('ui_elements_detected', []):
-                    ui_elements[element] = ui_elements.get(element, 0) + 1
-                
-                # Count user actions
-                for action in analysis.get('possible_user_actions', []):
-                    user_actions[action] = user_actions.get(action, 0) + 1
+            total_screenshots += screenshots
+            total_ai_analyses += successful_analyses
         
         return {
             "overview": {
@@ -147,8 +144,8 @@ class SitemapGenerator:
                 "average_sentences_per_page": total_sentences / total_pages if total_pages > 0 else 0
             },
             "page_statistics": page_stats,
-            "ui_elements_frequency": dict(sorted(ui_elements.items(), key=lambda x: x[1], reverse=True)[:20]),
-            "user_actions_frequency": dict(sorted(user_actions.items(), key=lambda x: x[1], reverse=True)[:20]),
+            "ui_elements_frequency": dict(ui_elements.most_common(20)),
+            "user_actions_frequency": dict(user_actions.most_common(20)),
             "coverage_metrics": {
                 "pages_with_screenshots": sum(1 for stat in page_stats if stat['screenshot_count'] > 0),
                 "pages_with_ai_analysis": sum(1 for stat in page_stats if stat['successful_ai_analyses'] > 0),
@@ -174,14 +171,16 @@ class SitemapGenerator:
         legacy_sentences = []
         
         for page in pages:
-            for sentence in page.get('sentences', []):
+            page_name = page.get('page_name')
+            relative_url = page.get('relative_url')
+            for sentence in page.get('sentences', ()):
                 legacy_sentence = {
                     "sentence_id": sentence.get('sentence_id'),
                     "sentence": sentence.get('user_description'),
                     "timestamp": sentence.get('timestamp'),
                     "screenshot": sentence.get('screenshot'),
-                    "page_name": page.get('page_name'),
-                    "relative_url": page.get('relative_url')
+                    "page_name": page_name,
+                    "relative_url": relative_url
                 }
                 legacy_sentences.append(legacy_sentence)
         
@@ -194,8 +193,7 @@ class SitemapGenerator:
         
         # Save legacy format
         legacy_path = output_dir / "legacy_sitemap_structure.json"
-        with open(legacy_path, 'w') as f:
-            json.dump(legacy_format, f, indent=2)
+        legacy_path.write_bytes(orjson.dumps(legacy_format, option=orjson.OPT_INDENT_2))
         
         print(f"Legacy format saved to: {legacy_path}")
         
@@ -4,9 +4,22 @@ Timestamp Mapping Functions
 Map cleaned sentences to timestamps using word-level data
 """
 
-import json
+import orjson
+from bisect import bisect_left
+from heapq import merge
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
+
+import numpy as np
+from rapidfuzz import fuzz
+
+# Punctuation trimmed from the ends of words before matching
+WORD_PUNCTUATION = '.,!?;:"'
+
+# Fuzzy fallback for sentences the word matcher misses: how far ahead to look,
+# and the minimum rapidfuzz ratio (0-100) for the opening words to count as found
+FUZZY_SEARCH_WORDS = 500
+FUZZY_SCORE_CUTOFF = 75
 
 class TimestampMapper:
     def __init__(self):
@@ -38,13 +51,25 @@ class TimestampMapper:
         
         print(f"Mapping {len(cleaned_sentences)} sentences using {len(word_data)} word timestamps...")
         
+        # Normalize every word once and index where it occurs, so each sentence
+        # only visits the positions that can start it instead of scanning word_data
+        self._norm_words = [word.get('word', '').lower().strip(WORD_PUNCTUATION) for word in word_data]
+        self._word_index = {}
+        for index, word in enumerate(self._norm_words):
+            if word:
+                self._word_index.setdefault(word, []).append(index)
+        self._max_word_length = max(map(len, self._word_index), default=0)
+        
+        # Tokenize every sentence once, up front
+        sentence_tokens = [sentence.lower().split() for sentence in cleaned_sentences]
+        
         mapped_sentences = []
         last_word_index = 0  # Track position in word list to ensure sequential processing
         
         for i, sentence in enumerate(cleaned_sentences):
             # Find timestamps for this sentence
             start_time, end_time, last_word_index = self._find_sentence_timestamps(
-                sentence, word_data, i, mapped_sentences, last_word_index
+                sentence_tokens[i], word_data, i, mapped_sentences, last_word_index
             )
             
             # Calculate mid timestamp
@@ -62,8 +87,7 @@ class TimestampMapper:
         
         # Save mapped sentences
         mapped_path = output_dir / "sentences_with_timestamps.json"
-        with open(mapped_path, 'w') as f:
-            json.dump(mapped_sentences, f, indent=2)
+        mapped_path.write_bytes(orjson.dumps(mapped_sentences, option=orjson.OPT_INDENT_2))
         
         print(f"Mapped sentences saved to: {mapped_path}")
         
@@ -75,7 +99,7 @@ class TimestampMapper:
     
     def _find_sentence_timestamps(
         self, 
-        sentence: str, 
+        sentence_tokens_lower: List[str], 
         word_data: List[Dict], 
         sentence_index: int, 
         previous_sentences: List[Dict],
@@ -85,7 +109,7 @@ class TimestampMapper:
         Find start and end timestamps for a sentence
         
         Args:
-            sentence: The sentence to find timestamps for
+            sentence_tokens_lower: Lowercased whitespace tokens of the sentence
             word_data: List of word-level timestamp data
             sentence_index: Index of current sentence
             previous_sentences: Previously processed sentences
@@ -95,52 +119,53 @@ class TimestampMapper:
             Tuple of (start_time, end_time, next_search_index)
         """
         # Use first 3-5 words to find position in original transcript
-        words = sentence.split()[:5]
-        search_text = ' '.join(words).lower()
+        search_text = ' '.join(sentence_tokens_lower[:5])
+        test_words = sentence_tokens_lower
+        
+        # Loop invariants, bound to locals once
+        norm_words = self._norm_words
+        word_count = len(word_data)
+        sentence_length = len(test_words)
+        required_matches = min(3, sentence_length)
         
         start_time = None
         end_time = None
         next_search_index = start_search_index
         
-        # Search for matching words in word data, starting from last position
-        for j in range(start_search_index, len(word_data)):
-            word_info = word_data[j]
-            word_text = word_info.get('word', '').lower().strip('.,!?;:"')
+        # Visit, in transcript order from the last position, every word that
+        # could be the start of our sentence (i.e. occurs inside search_text)
+        candidates = merge(*(
+            map(positions.__getitem__, range(bisect_left(positions, start_search_index), len(positions)))
+            for positions in self._positions_within(search_text)
+        ))
+        
+        for j in candidates:
+            # Try to match more words to confirm
+            match_count = 0
             
-            # Check if this could be the start of our sentence
-            if word_text and word_text in search_text:
-                # Try to match more words to confirm
-                match_count = 0
-                test_words = sentence.lower().split()
+            window_end = min(j + 10, word_count)
+            for k in range(j, window_end):
+                test_word = norm_words[k]
+                if match_count < sentence_length and test_word in test_words[match_count:match_count+3]:
+                    match_count += 1
                 
-                for k in range(j, min(j + 10, len(word_data))):
-                    test_word = word_data[k].get('word', '').lower().strip('.,!?;:"')
-                    if match_count < len(test_words) and test_word in test_words[match_count:match_count+3]:
-                        match_count += 1
-                    
-                    if match_count >= min(3, len(test_words)):
-                        # Found a good match
-                        start_time = word_data[j].get('start', 0)
-                        
-                        # Find end time by looking ahead
-                        sentence_words = sentence.split()
-                        words_found = 0
-                        
-                        for m in range(j, min(j + len(sentence_words) + 10, len(word_data))):
-                            if words_found >= len(sentence_words) * 0.8:
-                                end_time = word_data[m].get('end', start_time + 5)
-                                next_search_index = m + 1
-                                break
-                            words_found += 1
-                        
-                        if end_time is None:
-                            end_time = word_data[min(j + len(sentence_words), len(word_data)-1)].get('end', start_time + 5)
-                            next_search_index = j + len(sentence_words)
-                        
-                        break
+                if match_count >= required_matches:
+                    # Found a good match
+                    start_time, end_time, next_search_index = self._sentence_span(j, word_data, sentence_length)
+                    break
                 
-                if start_time is not None:
+                if match_count + (window_end - k - 1) < required_matches:
+                    # Too few words left in the window to confirm this candidate
                     break
+            
+            if start_time is not None:
+                break
+        
+        # Reworded or misheard openings: look for a close match just ahead
+        if start_time is None:
+            j = self._fuzzy_sentence_start(test_words, start_search_index)
+            if j is not None:
+                start_time, end_time, next_search_index = self._sentence_span(j, word_data, sentence_length)
         
         # Fallback timing if not found
         if start_time is None:
@@ -150,13 +175,72 @@ class TimestampMapper:
                 start_time = 0
             
             # Move search index forward to avoid getting stuck
-            next_search_index = min(start_search_index + 50, len(word_data))
+            next_search_index = min(start_search_index + 50, word_count)
         
         if end_time is None:
-            end_time = start_time + max(3, len(sentence.split()) * 0.4)
+            end_time = start_time + max(3, sentence_length * 0.4)
         
         return start_time, end_time, next_search_index
     
+    def _sentence_span(self, j: int, word_data: List[Dict], sentence_length: int) -> tuple:
+        """
+        Timestamps of a sentence of sentence_length words starting at word j
+        
+        Returns:
+            Tuple of (start_time, end_time, next_search_index)
+        """
+        start_time = word_data[j].get('start', 0)
+        
+        # Find end time by looking ahead
+        word_count = len(word_data)
+        words_needed = sentence_length * 0.8
+        words_found = 0
+        
+        for m in range(j, min(j + sentence_length + 10, word_count)):
+            if words_found >= words_needed:
+                return start_time, word_data[m].get('end', start_time + 5), m + 1
+            words_found += 1
+        
+        end_time = word_data[min(j + sentence_length, word_count-1)].get('end', start_time + 5)
+        return start_time, end_time, j + sentence_length
+    
+    def _fuzzy_sentence_start(self, sentence_tokens_lower: List[str], start_search_index: int) -> Optional[int]:
+        """
+        Find where a sentence starts by fuzzy-matching its opening words
+        
+        Windows of the same word count in the next FUZZY_SEARCH_WORDS words are
+        scored in order with rapidfuzz; the first at or above FUZZY_SCORE_CUTOFF
+        wins, so a better-scoring repeat further ahead cannot skip the sentence past
+        the transcript it belongs to.
+        
+        Args:
+            sentence_tokens_lower: Lowercased whitespace tokens of the sentence
+            start_search_index: Index to start searching from
+        
+        Returns:
+            Index of the first word of the first close window, or None if none is close enough
+        """
+        opening = [token.strip(WORD_PUNCTUATION) for token in sentence_tokens_lower[:5]]
+        stop = min(start_search_index + FUZZY_SEARCH_WORDS, len(self._norm_words) - len(opening) + 1)
+        if not opening or stop <= start_search_index:
+            return None
+        
+        needle = ' '.join(opening)
+        for j in range(start_search_index, stop):
+            window = ' '.join(self._norm_words[j:j + len(opening)])
+            if fuzz.ratio(needle, window, score_cutoff=FUZZY_SCORE_CUTOFF):
+                return j
+        return None
+    
+    def _positions_within(self, search_text: str) -> List[List[int]]:
+        """Sorted word_data positions of every indexed word that occurs inside search_text"""
+        substrings = {
+            search_text[start:end]
+            for start in range(len(search_text))
+            for end in range(start + 1, min(start + self._max_word_length, len(search_text)) + 1)
+        }
+        return [self._word_index[word] for word in substrings if word in self._word_index]
+    
     def validate_timestamps(self, mapped_sentences: List[Dict]) -> Dict:
         """
         Validate timestamp consistency and provide statistics
@@ -172,22 +256,18 @@ class TimestampMapper:
         
         issues = []
         
+        # Gap between each sentence's start and the previous sentence's end
+        starts = np.array([sentence['start_timestamp'] for sentence in mapped_sentences], dtype=np.float64)
+        ends = np.array([sentence['end_timestamp'] for sentence in mapped_sentences], dtype=np.float64)
+        gaps = starts[1:] - ends[:-1]
+        
         # Check for overlapping timestamps
-        for i in range(1, len(mapped_sentences)):
-            prev_end = mapped_sentences[i-1]['end_timestamp']
-            curr_start = mapped_sentences[i]['start_timestamp']
-            
-            if curr_start < prev_end:
-                issues.append(f"Sentence {i}: overlapping timestamps")
+        for i in np.flatnonzero(starts[1:] < ends[:-1]):
+            issues.append(f"Sentence {i + 1}: overlapping timestamps")
         
         # Check for unreasonable gaps
-        for i in range(1, len(mapped_sentences)):
-            prev_end = mapped_sentences[i-1]['end_timestamp']
-            curr_start = mapped_sentences[i]['start_timestamp']
-            gap = curr_start - prev_end
-            
-            if gap > 30:  # More than 30 seconds gap
-                issues.append(f"Sentence {i}: large gap ({gap:.1f}s)")
+        for i in np.flatnonzero(gaps > 30):  # More than 30 seconds gap
+            issues.append(f"Sentence {i + 1}: large gap ({gaps[i]:.1f}s)")
         
         total_duration = (
             mapped_sentences[-1]['end_timestamp'] - 
@@ -1,25 +1,39 @@
 #!/usr/bin/env python3
 """
 Transcript Cleaning Functions
-Clean transcripts into proper sentences using GPT-4
+Clean transcripts into proper sentences using GPT
 """
 
-import json
+import asyncio
+import hashlib
+import orjson
+import re
 from pathlib import Path
-from typing import List, Dict
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
+from typing import List, Dict, Optional
 
-load_dotenv()
+from openai import AsyncOpenAI
+
+from .openai_client import create_async_openai_client, create_completion_with_retry_async
+
+# One line of the cleaned reply: "12. Sentence text"
+NUMBERED_SENTENCE_PATTERN = re.compile(r'^\s*\d+\.\s+(.+?)\s*$')
 
 class TranscriptCleaner:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    def __init__(
+        self,
+        max_concurrent_requests: int = 5,
+        cache_dir: Optional[Path] = None,
+        refresh_cache: bool = False
+    ):
+        self.max_concurrent_requests = max_concurrent_requests
+        self.model = "gpt-4o-mini"  # Text cleanup and sentence splitting; no need for a full-size model
+        self.cleaning_prompt_version = 1  # Bump when the cleaning prompt changes to invalidate cached chunks
+        self.cache_dir = cache_dir or Path.home() / '.cache' / 'vector-data' / 'transcript_chunks'
+        self.refresh_cache = refresh_cache  # Ignore (and overwrite) cached chunks
     
     def clean_transcript(self, transcription_data: Dict, output_dir: Path) -> List[str]:
         """
-        Clean transcript into clear sentences using GPT-4
+        Clean transcript into clear sentences using GPT
         
         Args:
             transcription_data: Raw transcription data
@@ -31,7 +45,7 @@ class TranscriptCleaner:
         output_dir.mkdir(exist_ok=True)
         
         full_text = transcription_data['text']
-        print(f"Cleaning transcript with GPT-4...")
+        print(f"Cleaning transcript with {self.model}...")
         print(f"Text length: {len(full_text):,} characters")
         
         # Split text into chunks for GPT processing
@@ -40,28 +54,15 @@ class TranscriptCleaner:
         
         print(f"Processing {len(text_chunks)} text chunks...")
         
-        all_cleaned_sentences = []
-        
-        for i, chunk in enumerate(text_chunks):
-            print(f"Processing chunk {i+1}/{len(text_chunks)}...")
-            
-            try:
-                sentences = self._clean_text_chunk(chunk, len(all_cleaned_sentences))
-                all_cleaned_sentences.extend(sentences)
-                print(f"  Added {len(sentences)} sentences")
-                
-            except Exception as e:
-                print(f"Error cleaning chunk {i+1}: {e}")
-                # Fallback: split by periods
-                fallback_sentences = self._fallback_sentence_split(chunk)
-                all_cleaned_sentences.extend(fallback_sentences)
+        # One result per chunk, in chunk order however the requests finish
+        chunk_sentences = asyncio.run(self._clean_text_chunks(text_chunks))
+        all_cleaned_sentences = [sentence for sentences in chunk_sentences for sentence in sentences]
         
         print(f"Generated {len(all_cleaned_sentences)} cleaned sentences")
         
         # Save cleaned sentences
         cleaned_path = output_dir / "cleaned_sentences.json"
-        with open(cleaned_path, 'w') as f:
-            json.dump(all_cleaned_sentences, f, indent=2)
+        cleaned_path.write_bytes(orjson.dumps(all_cleaned_sentences, option=orjson.OPT_INDENT_2))
         
         print(f"Saved cleaned sentences to: {cleaned_path}")
         return all_cleaned_sentences
@@ -73,27 +74,67 @@ class TranscriptCleaner:
         
         text_chunks = []
         sentences = text.split('. ')
-        current_chunk = ""
+        
+        # Collect the current chunk's pieces and track its length, joining
+        # only when a chunk is finished instead of re-copying it per sentence
+        current_parts = []
+        current_length = 0
         
         for sentence in sentences:
-            if len(current_chunk + sentence) > max_chunk_size:
-                if current_chunk:
-                    text_chunks.append(current_chunk.strip())
-                    current_chunk = sentence + ". "
+            if current_length + len(sentence) > max_chunk_size:
+                if current_parts:
+                    text_chunks.append(''.join(current_parts).strip())
                 else:
                     # Single sentence too long, force split
                     text_chunks.append(sentence[:max_chunk_size])
-                    current_chunk = sentence[max_chunk_size:] + ". "
+                    sentence = sentence[max_chunk_size:]
+                current_parts = [sentence, ". "]
+                current_length = len(sentence) + 2
             else:
-                current_chunk += sentence + ". "
+                current_parts += (sentence, ". ")
+                current_length += len(sentence) + 2
         
-        if current_chunk:
-            text_chunks.append(current_chunk.strip())
+        if current_parts:
+            text_chunks.append(''.join(current_parts).strip())
         
         return text_chunks
     
-    def _clean_text_chunk(self, chunk: str, sentence_offset: int) -> List[str]:
-        """Clean a single text chunk using GPT-4"""
+    async def _clean_text_chunks(self, text_chunks: List[str]) -> List[List[str]]:
+        """Clean every chunk concurrently; results come back in chunk order"""
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        
+        async with create_async_openai_client() as client:
+            async def clean(i: int, chunk: str) -> List[str]:
+                cache_path = self._chunk_cache_path(chunk)
+                cached_sentences = self._load_cached_sentences(cache_path)
+                if cached_sentences is not None:
+                    print(f"  Chunk {i+1}: reused {len(cached_sentences)} cached sentences")
+                    return cached_sentences
+                
+                async with semaphore:
+                    print(f"Processing chunk {i+1}/{len(text_chunks)}...")
+                    
+                    try:
+                        sentences = await self._clean_text_chunk(client, chunk)
+                        print(f"  Chunk {i+1}: added {len(sentences)} sentences")
+                        if sentences:
+                            self._save_cached_sentences(cache_path, sentences)
+                        return sentences
+                    
+                    except Exception as e:
+                        print(f"Error cleaning chunk {i+1}: {e}")
+                        # Fallback: split by periods
+                        return self._fallback_sentence_split(chunk)
+            
+            return await asyncio.gather(*(clean(i, chunk) for i, chunk in enumerate(text_chunks)))
+    
+    async def _clean_text_chunk(self, client: AsyncOpenAI, chunk: str) -> List[str]:
+        """
+        Clean a single text chunk using GPT
+        
+        Chunks are cleaned concurrently, so each one is numbered from 1; the
+        numbers are only a reply format and are stripped when parsing.
+        """
         prompt = f"""
         Clean up this video transcript and convert it into clear, numbered sentences.
         
@@ -105,36 +146,55 @@ class TranscriptCleaner:
         2. Fix grammar and sentence structure
         3. Keep technical terms accurate (like "FTP", "TrainingPeaks", "Strava", etc.)
         4. Break into logical, complete sentences
-        5. Number each sentence starting from {sentence_offset + 1}
+        5. Number each sentence starting from 1
         6. Keep the meaning and intent intact
         
         Return ONLY the numbered sentences, one per line:
-        {sentence_offset + 1}. First clean sentence here.
-        {sentence_offset + 2}. Second clean sentence here.
+        1. First clean sentence here.
+        2. Second clean sentence here.
         etc.
         """
         
-        response = self.client.chat.completions.create(
-            model="gpt-4",
+        response = await create_completion_with_retry_async(
+            client,
+            model=self.model,
             messages=[{"role": "user", "content": prompt}],
-            max_tokens=2000,
+            max_tokens=4000,  # Room for a full 6000-character chunk rewritten as sentences
             temperature=0.1
         )
         
         cleaned_text = response.choices[0].message.content.strip()
         
-        # Parse numbered sentences
-        sentences = []
-        lines = cleaned_text.split('\n')
-        for line in lines:
-            line = line.strip()
-            if line and (line[0].isdigit() or '. ' in line):
-                # Extract sentence text (remove number prefix)
-                if '. ' in line:
-                    sentence_text = line.split('. ', 1)[1]
-                    sentences.append(sentence_text)
-        
-        return sentences
+        # Parse numbered sentences, removing the number prefix
+        return [
+            match.group(1)
+            for match in map(NUMBERED_SENTENCE_PATTERN.match, cleaned_text.splitlines())
+            if match
+        ]
+    
+    def _chunk_cache_path(self, chunk: str) -> Path:
+        """Cache file for a chunk's cleaned sentences, keyed by chunk text, model and prompt version"""
+        key = hashlib.sha256(f"{self.model}:{self.cleaning_prompt_version}:{chunk}".encode()).hexdigest()
+        return self.cache_dir / f"{key}.json"
+    
+    def _load_cached_sentences(self, cache_path: Path) -> Optional[List[str]]:
+        """Return the cached sentences for a chunk, if any"""
+        if self.refresh_cache or not cache_path.exists():
+            return None
+        
+        try:
+            return orjson.loads(cache_path.read_bytes())
+        except (OSError, orjson.JSONDecodeError) as e:
+            print(f"  Warning: Ignoring unreadable cache entry {cache_path}: {e}")
+            return None
+    
+    def _save_cached_sentences(self, cache_path: Path, sentences: List[str]):
+        """Store the cleaned sentences of a chunk"""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            cache_path.write_bytes(orjson.dumps(sentences))
+        except OSError as e:
+            print(f"  Warning: Could not write cache entry {cache_path}: {e}")
     
     def _fallback_sentence_split(self, chunk: str) -> List[str]:
         """Fallback method to split text when GPT fails"""
@@ -4,9 +4,11 @@ Main Video Processing Orchestrator
 Coordinates all video processing steps
 """
 
-import json
+import orjson
 import shutil
 import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional
 
@@ -22,11 +24,37 @@ from .sitemap_generator import SitemapGenerator
 from .enhanced_segment_analyzer import EnhancedSegmentAnalyzer
 from .screenshot_deduplicator import ScreenshotDeduplicator
 
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
+# The only complete_transcription.json fields used when transcription is skipped
+TRANSCRIPTION_SUMMARY_FIELDS = ('duration', 'total_words', 'total_chunks')
+
+def _clone_tree(src: Path, dst: Path):
+    """
+    Copy a directory tree as copy-on-write clones where the filesystem supports them
+    
+    Clones share blocks until written (btrfs/XFS reflinks, APFS clonefile), so
+    publishing is near-instant, yet a rerun that rewrites the working files
+    leaves the published ones untouched - unlike hard links.
+    """
+    clone_flag = '-c' if sys.platform == 'darwin' else '--reflink=auto'
+    try:
+        subprocess.run(['cp', '-R', clone_flag, str(src), str(dst)], check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError):
+        # No cp, or no cloning support (macOS cp -c does not fall back itself)
+        shutil.rmtree(dst, ignore_errors=True)
+        shutil.copytree(src, dst)
+
 class VideoProcessor:
     def __init__(self, video_path: str, output_dir: str = "video_processing"):
         self.video_path = Path(video_path)
         self.output_dir = Path(output_dir)
         self.transcription_dir = self.output_dir / "transcription_output"
+        self._audio_path = None  # Set by _find_audio_file once the audio file is found
         
         # Initialize components
         self.transcriber = AudioTranscriber()
@@ -81,17 +109,15 @@ class VideoProcessor:
             if not all(p.exists() for p in [transcription_path, cleaned_path, mapped_path]):
                 raise FileNotFoundError("Required transcription files not found. Run without --skip-transcription first.")
             
-            # Load transcription data
-            with open(transcription_path) as f:
-                transcription_data = json.load(f)
-            
-            # Load cleaned sentences
-            with open(cleaned_path) as f:
-                cleaned_sentences = json.load(f)
-            
-            # Load mapped sentences
-            with open(mapped_path) as f:
-                mapped_sentences = json.load(f)
+            # Load transcription data (only its duration and counts are used from here on),
+            # cleaned sentences and mapped sentences side by side
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                transcription_future = executor.submit(self._load_transcription_summary, transcription_path)
+                cleaned_future = executor.submit(lambda: orjson.loads(cleaned_path.read_bytes()))
+                mapped_future = executor.submit(lambda: orjson.loads(mapped_path.read_bytes()))
+                transcription_data = transcription_future.result()
+                cleaned_sentences = cleaned_future.result()
+                mapped_sentences = mapped_future.result()
             
             # Get audio file info
             if audio_file:
@@ -291,16 +317,44 @@ class VideoProcessor:
         
         # Save summary
         summary_path = self.transcription_dir / "processing_summary.json"
-        with open(summary_path, 'w') as f:
-            json.dump(summary, f, indent=2)
+        summary_path.write_bytes(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
         
         print(f"\n🎉 Video processing complete!")
         print(f"Summary saved to: {summary_path}")
         
         return summary
     
+    def _load_transcription_summary(self, transcription_path: Path) -> Dict:
+        """
+        Read the scalar summary fields of a saved transcription
+        
+        With ijson the file is streamed and its words list is never built;
+        otherwise the whole file is parsed and everything else dropped.
+        
+        Args:
+            transcription_path: Path to complete_transcription.json
+        
+        Returns:
+            Dictionary with whichever of TRANSCRIPTION_SUMMARY_FIELDS the file has
+        """
+        if not IJSON_AVAILABLE:
+            transcription_data = orjson.loads(transcription_path.read_bytes())
+            return {key: transcription_data[key] for key in TRANSCRIPTION_SUMMARY_FIELDS if key in transcription_data}
+        
+        summary = {}
+        with open(transcription_path, 'rb') as f:
+            for prefix, event, value in ijson.parse(f, use_float=True):
+                if event == 'number' and prefix in TRANSCRIPTION_SUMMARY_FIELDS:
+                    summary[prefix] = value
+                    if len(summary) == len(TRANSCRIPTION_SUMMARY_FIELDS):
+                        break
+        return summary
+    
     def _find_audio_file(self) -> Optional[Path]:
-        """Find the audio file in the video processing directory"""
+        """Find the audio file in the video processing directory (remembered once found)"""
+        if self._audio_path is not None:
+            return self._audio_path
+        
         # Look for common audio file patterns
         possible_paths = [
             self.output_dir / f"{self.video_path.stem}_audio.mp3",
@@ -312,6 +366,7 @@ class VideoProcessor:
         
         for path in possible_paths:
             if path.exists():
+                self._audio_path = path
                 return path
         
         return None
@@ -326,8 +381,7 @@ class VideoProcessor:
         }
         
         if status["summary_available"]:
-            with open(self.transcription_dir / "processing_summary.json") as f:
-                status["last_summary"] = json.load(f)
+            status["last_summary"] = orjson.loads((self.transcription_dir / "processing_summary.json").read_bytes())
         
         return status
     
@@ -342,18 +396,17 @@ class VideoProcessor:
             screenshots_dest = final_output_dir / f"screenshots_{video_name}"
             
             if screenshots_src.exists() and not screenshots_dest.exists():
-                shutil.copytree(screenshots_src, screenshots_dest)
+                _clone_tree(screenshots_src, screenshots_dest)
                 print(f"Screenshots copied to: {screenshots_dest}")
             
             # Update screenshot paths in the final sitemap
             sitemap_path = final_output_dir / f"{video_name}_site_map.json"
             if sitemap_path.exists():
-                # Use sed to update paths
-                subprocess.run([
-                    'sed', '-i', '', 
-                    f's/"screenshots\\//"screenshots_{video_name}\\//g',
-                    str(sitemap_path)
-                ], check=True)
+                # Point screenshot paths at the renamed directory
+                sitemap_bytes = sitemap_path.read_bytes()
+                sitemap_path.write_bytes(
+                    sitemap_bytes.replace(b'"screenshots/', f'"screenshots_{video_name}/'.encode())
+                )
                 print(f"Screenshot paths updated in: {sitemap_path}")
                 
         except Exception as e: